@@ -0,0 +1,23 @@
+# amounts.py
+# Parsing angka nominal gaya Indonesia: titik sebagai pemisah ribuan ("15.000", "1.500.000")
+# dan koma sebagai desimal ("1,5"), dengan toleransi untuk penulisan gaya Inggris ("15,000", "12.5").
+import re
+
+SEPARATOR_RE = re.compile(r'[.,]')
+
+
+def parse_number(number: str) -> float:
+    """
+    Parses a written number. A separator followed by exactly three digits is a thousands
+    separator ("15.000", "1.500.000", "15,000"); otherwise the last separator is the decimal
+    point ("1,5", "12.5", "1.500,50"). Raises ValueError when the text is not a number.
+    """
+    number = number.strip()
+    groups = SEPARATOR_RE.split(number)
+    if len(groups) == 1:
+        return float(number)
+    if not all(group.isdigit() for group in groups[1:]):
+        raise ValueError(f"Angka tidak valid: {number}")
+    if groups[0] and all(len(group) == 3 for group in groups[1:]):
+        return float("".join(groups))
+    return float(f"{''.join(groups[:-1])}.{groups[-1]}")
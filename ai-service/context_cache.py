@@ -0,0 +1,264 @@
+# context_cache.py
+# Context caching Gemini untuk bagian statis prompt (daftar merk, tabel savings, kategori, skema output).
+# Bagian statis diunggah sekali ke cachedContents dan direferensikan lewat handle pada request berikutnya.
+# Handle diperbarui sebelum kedaluwarsa; jika cache tidak tersedia, request memakai prompt penuh.
+# Gemini hanya meng-cache konten di atas ukuran minimum, jadi cache baru dipakai jika bagian
+# statis cukup besar (prompt saat ini jauh di bawahnya, sehingga default-nya nonaktif).
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+import providers
+import recorder
+import timing
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "false").lower() == "true"
+# Model untuk kedua jalur (cache dan prompt penuh) agar hasilnya sebanding. Context caching
+# hanya tersedia untuk model dengan versi eksplisit, misalnya gemini-1.5-flash-002; dengan
+# model tanpa versi (default-nya sama dengan provider), cache tidak dipakai.
+CONTEXT_CACHE_MODEL = os.getenv("CONTEXT_CACHE_MODEL", providers.GEMINI_MODEL)
+VERSIONED_MODEL_RE = re.compile(r"-\d{3}$")
+# Ukuran minimum konten yang diterima cachedContents (32.768 token untuk gemini-1.5)
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# Handle diperpanjang jika sisa umurnya kurang dari margin ini
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN", "300"))
+# Setelah gagal membuat cache (misalnya prompt di bawah ukuran minimum), jangan coba lagi selama ini
+CONTEXT_CACHE_RETRY_AFTER = int(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "3600"))
+
+_handles = {}
+# Nama cache yang sedang dibuat/diperpanjang; request lain tidak ikut menunggu panggilan jaringan
+_inflight = set()
+_too_small = set()
+_unversioned_logged = False
+_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _cache_url(api_key: str, handle: str = "") -> str:
+    # Handle sudah berbentuk "cachedContents/{id}"
+    return f"{providers.GEMINI_BASE_URL}/v1beta/{handle or 'cachedContents'}?key={api_key}"
+
+
+def estimate_tokens(text: str) -> int:
+    # Perkiraan kasar: sekitar 4 karakter per token
+    return len(text) // 4
+
+
+def _model_versioned() -> bool:
+    global _unversioned_logged
+    if VERSIONED_MODEL_RE.search(CONTEXT_CACHE_MODEL):
+        return True
+    with _lock:
+        first = not _unversioned_logged
+        _unversioned_logged = True
+    if first:
+        logger.error(
+            f"CONTEXT_CACHE_ENABLED=true tapi CONTEXT_CACHE_MODEL '{CONTEXT_CACHE_MODEL}' tidak punya versi "
+            f"eksplisit (misalnya gemini-1.5-flash-002); context cache tidak dipakai"
+        )
+    return False
+
+
+def _large_enough(name: str, static_text: str) -> bool:
+    tokens = estimate_tokens(static_text)
+    if tokens >= CONTEXT_CACHE_MIN_TOKENS:
+        return True
+    with _lock:
+        first = name not in _too_small
+        _too_small.add(name)
+    if first:
+        logger.info(
+            f"Prompt statis '{name}' sekitar {tokens} token, di bawah minimum context cache "
+            f"({CONTEXT_CACHE_MIN_TOKENS}); memakai prompt penuh"
+        )
+    return False
+
+
+def _usable(state: dict, now: float) -> bool:
+    return state is not None and bool(state["handle"]) and state["expires_at"] > now
+
+
+def _create(name: str, static_text: str, api_key: str) -> dict:
+    payload = {
+        "model": f"models/{CONTEXT_CACHE_MODEL}",
+        "displayName": name,
+        "systemInstruction": {"parts": [{"text": static_text}]},
+        "ttl": f"{CONTEXT_CACHE_TTL}s",
+    }
+    response = providers.get_session("gemini").post(_cache_url(api_key), json=payload, timeout=30)
+    response.raise_for_status()
+    logger.info(f"Context cache '{name}' dibuat: {response.json().get('name')}")
+    return {"handle": response.json()["name"], "expires_at": time.time() + CONTEXT_CACHE_TTL, "failed_until": 0}
+
+
+def _refresh(state: dict, api_key: str) -> dict:
+    response = providers.get_session("gemini").patch(
+        _cache_url(api_key, state["handle"]) + "&updateMask=ttl",
+        json={"ttl": f"{CONTEXT_CACHE_TTL}s"},
+        timeout=30,
+    )
+    response.raise_for_status()
+    return dict(state, expires_at=time.time() + CONTEXT_CACHE_TTL, failed_until=0)
+
+
+def get_handle(name: str, static_text: str, api_key: str):
+    """
+    Returns a valid cachedContents handle for the static prompt, creating or refreshing it
+    when needed. Returns None when caching is disabled, CONTEXT_CACHE_MODEL has no explicit
+    version, the static prompt is below the provider's minimum size, or the cache is unavailable.
+    The network call runs outside the lock; while one request creates or refreshes a handle,
+    others use the current handle (or the full prompt) instead of waiting.
+    """
+    if not CONTEXT_CACHE_ENABLED or recorder.RECORD_MODE == "replay":
+        return None
+    if not _model_versioned():
+        return None
+    if not _large_enough(name, static_text):
+        return None
+
+    with _lock:
+        state = _handles.get(name)
+        now = time.time()
+        if state is not None and now < state["failed_until"]:
+            return state["handle"] if _usable(state, now) else None
+        if _usable(state, now) and state["expires_at"] - now > CONTEXT_CACHE_REFRESH_MARGIN:
+            return state["handle"]
+        if name in _inflight:
+            return state["handle"] if _usable(state, now) else None
+        _inflight.add(name)
+
+    new_state = None
+    try:
+        with timing.stage("context_cache"):
+            if _usable(state, now):
+                new_state = _refresh(state, api_key)
+            else:
+                new_state = _create(name, static_text, api_key)
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        if _usable(state, now):
+            # Handle lama masih berlaku: tetap dipakai sampai kedaluwarsa, lalu dibuat ulang
+            logger.warning(f"Gagal memperpanjang context cache '{name}', handle lama dipakai sampai kedaluwarsa: {str(e)}")
+            new_state = dict(state, failed_until=state["expires_at"])
+        else:
+            logger.warning(f"Context cache '{name}' tidak tersedia, memakai prompt penuh: {str(e)}")
+            new_state = {"handle": None, "expires_at": 0, "failed_until": now + CONTEXT_CACHE_RETRY_AFTER}
+    finally:
+        with _lock:
+            if new_state is not None:
+                _handles[name] = new_state
+            _inflight.discard(name)
+    return new_state["handle"]
+
+
+def invalidate(name: str):
+    with _lock:
+        _handles.pop(name, None)
+
+
+def record(name: str, path: str, latency_ms: float, usage: dict, ttft_ms: float = None):
+    """
+    Records latency and token usage of one call. ttft_ms (time to first token) is only known for streamed calls.
+    """
+    prompt_tokens = usage.get("promptTokenCount", 0)
+    cached_tokens = usage.get("cachedContentTokenCount", 0)
+    with _stats_lock:
+        stats = _stats.setdefault(name, {}).setdefault(path, {
+            "calls": 0, "latency_ms_total": 0.0, "prompt_tokens": 0, "cached_tokens": 0,
+            "stream_calls": 0, "ttft_ms_total": 0.0,
+        })
+        stats["calls"] += 1
+        stats["latency_ms_total"] += latency_ms
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        if ttft_ms is not None:
+            stats["stream_calls"] += 1
+            stats["ttft_ms_total"] += ttft_ms
+
+
+def _send(name: str, static_text: str, dynamic_parts: list, api_key: str, timeout: int, stream: bool):
+    """
+    Sends the request through the context cache when possible, otherwise with the full prompt.
+    Both paths use CONTEXT_CACHE_MODEL and send the static prompt as the system instruction,
+    so they only differ in whether that instruction is cached.
+    Returns (response, path, started) where path is "cached" or "full".
+    """
+    handle = get_handle(name, static_text, api_key)
+    headers = {"Content-Type": "application/json"}
+    method = "streamGenerateContent" if stream else "generateContent"
+    url = providers.gemini_url(api_key, method, model=CONTEXT_CACHE_MODEL) + ("&alt=sse" if stream else "")
+
+    if handle:
+        payload = {"cachedContent": handle, "contents": [{"role": "user", "parts": dynamic_parts}]}
+        started = time.perf_counter()
+        try:
+            response = providers.post("gemini", url, json=payload, headers=headers, timeout=timeout, stream=stream)
+            response.raise_for_status()
+            return response, "cached", started
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Request dengan context cache '{name}' gagal, memakai prompt penuh: {str(e)}")
+            # Handle kedaluwarsa atau dihapus di sisi provider: buang agar dibuat ulang
+            status_code = e.response.status_code if e.response is not None else None
+            if isinstance(e, requests.exceptions.HTTPError) and status_code in (None, 400, 403, 404):
+                invalidate(name)
+
+    payload = {
+        "systemInstruction": {"parts": [{"text": static_text}]},
+        "contents": [{"role": "user", "parts": dynamic_parts}],
+    }
+    started = time.perf_counter()
+    response = providers.post("gemini", url, json=payload, headers=headers, timeout=timeout, stream=stream)
+    response.raise_for_status()
+    return response, "full", started
+
+
+def generate(name: str, static_text: str, dynamic_parts: list, api_key: str, timeout: int):
+    """
+    Calls generateContent with the static prompt referenced through the context cache
+    and dynamic_parts (caption, date, image, ...) sent inline. Falls back to sending
+    the full prompt when the cache is unavailable or the handle is rejected.
+    """
+    response, path, started = _send(name, static_text, dynamic_parts, api_key, timeout, stream=False)
+    try:
+        usage = response.json().get("usageMetadata", {})
+    except ValueError:
+        usage = {}
+    record(name, path, (time.perf_counter() - started) * 1000, usage)
+    return response
+
+
+def open_stream(name: str, static_text: str, dynamic_parts: list, api_key: str, timeout: int):
+    """
+    Streaming variant of generate() using streamGenerateContent (SSE).
+    Returns (response, path, started); the caller reads the stream and calls record().
+    """
+    return _send(name, static_text, dynamic_parts, api_key, timeout, stream=True)
+
+
+def stats() -> dict:
+    """
+    Per prompt and path (cached/full): calls, average latency, average time to first token
+    (streamed calls only), and average prompt/cached/billed input tokens.
+    """
+    result = {}
+    with _stats_lock:
+        for name, paths in _stats.items():
+            result[name] = {"handle_active": bool(_handles.get(name, {}).get("handle"))}
+            for path, s in paths.items():
+                calls = s["calls"] or 1
+                result[name][path] = {
+                    "calls": s["calls"],
+                    "latency_ms_avg": round(s["latency_ms_total"] / calls, 1),
+                    "ttft_ms_avg": round(s["ttft_ms_total"] / s["stream_calls"], 1) if s["stream_calls"] else None,
+                    "prompt_tokens_avg": round(s["prompt_tokens"] / calls, 1),
+                    "cached_tokens_avg": round(s["cached_tokens"] / calls, 1),
+                    "billed_input_tokens_avg": round((s["prompt_tokens"] - s["cached_tokens"]) / calls, 1),
+                }
+    return result
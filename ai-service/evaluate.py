@@ -0,0 +1,298 @@
+# evaluate.py
+# Runner evaluasi offline: menilai akurasi field hasil ekstraksi terhadap label,
+# beserta biaya (token provider) dan latensi untuk setiap varian pipeline.
+#
+# Contoh:
+#   python evaluate.py --corpus recordings --variant replay --variant live
+#   python evaluate.py --corpus recordings --labels labels.jsonl --variant replay
+#   python evaluate.py --corpus recordings --prefilter 0.2 --prefilter 0.3 --prefilter 0.4
+#
+# Label diambil dari field "expected" pada baris rekaman, atau dari file --labels
+# berisi baris {"id": "<id rekaman>", "expected": {...} atau [{...}, ...]}.
+import argparse
+import json
+import os
+import time
+
+import recorder
+
+SCORED_FIELDS = ("kategori", "nominal", "tanggal", "berat", "jenis_lm")
+
+
+def _as_transactions(result) -> list:
+    """
+    Normalizes the output of any endpoint function into a list of transaction dicts.
+    """
+    if result is None:
+        return []
+    if isinstance(result, list):
+        return [item for item in result if isinstance(item, dict)]
+    if isinstance(result, dict):
+        if "transactions" in result:
+            return _as_transactions(result["transactions"])
+        if "note" in result or "error" in result or "summary" in result:
+            return []
+        return [result]
+    return []
+
+
+def _extract_function(p, provider):
+    return lambda inp: p.extract(inp, provider=provider)
+
+
+def load_pipelines() -> dict:
+    """
+    Returns the extraction pipelines per endpoint, as declared by main (LM) and keuangan.
+    Importing main builds the FastAPI app, but it is not started and no startup hook runs.
+    """
+    import keuangan
+    import main
+
+    pipelines = (main.LM_TEXT, main.LM_IMAGE, keuangan.KEUANGAN_TEXT, keuangan.KEUANGAN_IMAGE, keuangan.KEUANGAN_VOICE)
+    return {p.endpoint: p for p in pipelines}
+
+
+def _endpoint_functions(variant: str) -> dict:
+    """
+    Endpoint -> extraction function for a variant, without hedging so each variant measures
+    one provider. A variant that swaps a provider only covers the endpoints it changes; records
+    of other endpoints are reported as skipped rather than under its name.
+    """
+    pipelines = load_pipelines()
+    if variant == "deepseek":
+        keuangan_text = pipelines["process_expense_keuangan"]
+        return {keuangan_text.endpoint: _extract_function(keuangan_text, keuangan_text.hedge)}
+    return {endpoint: _extract_function(p, p.provider) for endpoint, p in pipelines.items()}
+
+
+def run_replay(record: dict, functions: dict):
+    """
+    Re-runs the current parsers over the recorded provider responses. Latency is the recorded one.
+    """
+    with recorder.activate(recorder.replaying(record["responses"])):
+        result = functions[record["endpoint"]](recorder.load_input(record["input"]))
+    return result, record.get("latency_ms") or 0.0, record["responses"]
+
+
+def run_live(record: dict, functions: dict):
+    """
+    Calls the real provider with the recorded input (costs money).
+    """
+    started = time.perf_counter()
+    with recorder.activate(recorder.capturing()) as recording:
+        result = functions[record["endpoint"]](recorder.load_input(record["input"]))
+    return result, (time.perf_counter() - started) * 1000, recording["responses"]
+
+
+# Varian pipeline: nama -> cara menjalankan satu rekaman.
+# "deepseek" hanya mengganti provider teks keuangan, jadi hanya menilai endpoint tersebut.
+VARIANTS = {
+    "replay": run_replay,
+    "live": run_live,
+    "deepseek": run_live,
+}
+
+
+def _tokens(responses: list) -> int:
+    total = 0
+    for response in responses:
+        body = response.get("body")
+        if not isinstance(body, dict):
+            continue
+        if "usageMetadata" in body:
+            total += body["usageMetadata"].get("totalTokenCount", 0)
+        elif "usage" in body:
+            total += body["usage"].get("total_tokens", 0)
+    return total
+
+
+def _field_equal(field: str, predicted, expected) -> bool:
+    if field in ("nominal", "berat"):
+        try:
+            return abs(float(predicted) - float(expected)) < 0.01
+        except (ValueError, TypeError):
+            return False
+    return str(predicted).strip().lower() == str(expected).strip().lower()
+
+
+def score(predicted: list, expected: list, field_stats: dict):
+    """
+    Compares transactions position by position; a missing transaction counts as wrong for every labeled field.
+    """
+    for index, expected_item in enumerate(expected):
+        predicted_item = predicted[index] if index < len(predicted) else {}
+        for field in SCORED_FIELDS:
+            if field not in expected_item:
+                continue
+            stats = field_stats.setdefault(field, {"correct": 0, "total": 0})
+            stats["total"] += 1
+            if field in predicted_item and _field_equal(field, predicted_item[field], expected_item[field]):
+                stats["correct"] += 1
+
+
+def _percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 1)
+
+
+def _new_totals() -> dict:
+    return {"field_stats": {}, "latencies": [], "tokens": 0, "calls": 0, "errors": 0, "labeled": 0}
+
+
+def _summarize(totals: dict) -> dict:
+    field_stats = totals["field_stats"]
+    correct = sum(s["correct"] for s in field_stats.values())
+    total = sum(s["total"] for s in field_stats.values())
+    return {
+        "records": len(totals["latencies"]) + totals["errors"],
+        "labeled": totals["labeled"],
+        "errors": totals["errors"],
+        "accuracy": round(correct / total, 4) if total else None,
+        "fields": {f: round(s["correct"] / s["total"], 4) for f, s in field_stats.items() if s["total"]},
+        "provider_calls": totals["calls"],
+        "tokens": totals["tokens"],
+        "latency_p50_ms": _percentile(totals["latencies"], 0.5),
+        "latency_p95_ms": _percentile(totals["latencies"], 0.95),
+    }
+
+
+def evaluate(corpus: list, labels: dict, variant: str) -> dict:
+    """
+    Runs a variant over the corpus. The report has the totals over the endpoints the variant
+    covers, the same figures per endpoint, and the number of records per endpoint it skipped.
+    """
+    functions = _endpoint_functions(variant)
+    runner = VARIANTS[variant]
+    totals = _new_totals()
+    per_endpoint = {}
+    skipped = {}
+
+    for record in corpus:
+        endpoint = record["endpoint"]
+        if endpoint not in functions:
+            skipped[endpoint] = skipped.get(endpoint, 0) + 1
+            continue
+        targets = (totals, per_endpoint.setdefault(endpoint, _new_totals()))
+        try:
+            result, latency_ms, responses = runner(record, functions)
+        except Exception as e:
+            print(f"[{variant}] {record['id']}: error {str(e)}")
+            for t in targets:
+                t["errors"] += 1
+            continue
+
+        expected = labels.get(record["id"], record.get("expected"))
+        for t in targets:
+            t["latencies"].append(latency_ms)
+            t["calls"] += len(responses)
+            t["tokens"] += _tokens(responses)
+            if expected is not None:
+                t["labeled"] += 1
+                score(_as_transactions(result), _as_transactions(expected), t["field_stats"])
+
+    return dict(
+        variant=variant,
+        **_summarize(totals),
+        endpoints={endpoint: _summarize(t) for endpoint, t in per_endpoint.items()},
+        skipped=skipped,
+    )
+
+
+# Pre-filter struk hanya dipasang di endpoint gambar keuangan
+PREFILTER_ENDPOINT = "process_image_expense_keuangan"
+
+
+def evaluate_prefilter(corpus: list, labels: dict, min_scores: list) -> list:
+    """
+    Evaluates the receipt pre-filter on recorded images for each PREFILTER_MIN_SCORE value.
+    An image counts as a receipt when its label (or else the recorded result) has transactions.
+    The pre-filter is bypassed in record mode, so the corpus includes images it would reject.
+    Images the pre-filter cannot analyse pass through, as in receipt_filter.check_image.
+    """
+    import base64
+    import receipt_filter
+
+    if receipt_filter.Image is None:
+        raise Exception("Pillow tidak terpasang, pre-filter tidak bisa dievaluasi")
+
+    samples = []
+    for record in corpus:
+        if record["endpoint"] != PREFILTER_ENDPOINT or record.get("error"):
+            continue
+        expected = labels.get(record["id"], record.get("expected", record.get("result")))
+        started = time.perf_counter()
+        try:
+            features = receipt_filter.extract_features(base64.b64decode(recorder.load_input(record["input"])["image"]))
+        except (OSError, ValueError, receipt_filter.Image.DecompressionBombError) as e:
+            print(f"Gambar {record['id']} tidak bisa dianalisis, dihitung lolos: {str(e)}")
+            features = None
+        samples.append((features, bool(_as_transactions(expected)), (time.perf_counter() - started) * 1000))
+
+    reports = []
+    for min_score in min_scores:
+        receipt_filter.PREFILTER_MIN_SCORE = min_score
+        counts = {"rejected": 0, "false_rejects": 0, "missed_non_receipts": 0}
+        for features, is_receipt, _ in samples:
+            rejected = features is not None and not receipt_filter.score_features(features)["is_receipt"]
+            counts["rejected"] += rejected
+            counts["false_rejects"] += rejected and is_receipt
+            counts["missed_non_receipts"] += not rejected and not is_receipt
+        non_receipts = sum(1 for _, is_receipt, _ in samples if not is_receipt)
+        reports.append(dict(
+            counts,
+            min_score=min_score,
+            images=len(samples),
+            undecodable=sum(1 for features, _, _ in samples if features is None),
+            non_receipts=non_receipts,
+            # Rasio panggilan vision yang dihemat dari semua gambar
+            vision_calls_saved=round(counts["rejected"] / len(samples), 4) if samples else 0.0,
+            elapsed_ms_avg=round(sum(ms for _, _, ms in samples) / len(samples), 2) if samples else 0.0,
+        ))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluasi offline pipeline ekstraksi terhadap korpus rekaman")
+    parser.add_argument("--corpus", default=recorder.RECORD_DIR, help="File JSONL atau direktori rekaman")
+    parser.add_argument("--labels", help="File JSONL berisi label {id, expected}")
+    parser.add_argument("--variant", action="append", choices=sorted(VARIANTS), help="Varian pipeline (boleh berulang)")
+    parser.add_argument("--endpoint", action="append", help="Batasi ke endpoint tertentu")
+    parser.add_argument("--prefilter", action="append", type=float, metavar="MIN_SCORE",
+                        help="Evaluasi pre-filter struk dengan ambang skor ini (boleh berulang)")
+    args = parser.parse_args()
+
+    # Rekaman dibaca dari --corpus; jangan tulis rekaman baru selama evaluasi
+    recorder.set_mode("off")
+    if os.path.isdir(args.corpus):
+        recorder.RECORD_DIR = args.corpus
+    else:
+        recorder.RECORD_DIR = os.path.dirname(args.corpus) or "."
+
+    corpus = [r for r in recorder.read_corpus(args.corpus) if "endpoint" in r]
+    if args.endpoint:
+        corpus = [r for r in corpus if r["endpoint"] in args.endpoint]
+
+    labels = {}
+    if args.labels:
+        for entry in recorder.read_corpus(args.labels):
+            labels[entry["id"]] = entry["expected"]
+
+    if args.prefilter:
+        for report in evaluate_prefilter(corpus, labels, args.prefilter):
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        if not args.variant:
+            return
+
+    variants = args.variant or ["replay"]
+    if set(variants) == {"replay"}:
+        import providers
+        providers.use_replay_keys()
+
+    for variant in variants:
+        print(json.dumps(evaluate(corpus, labels, variant), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
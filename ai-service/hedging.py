@@ -0,0 +1,152 @@
+# hedging.py
+# Hedged request untuk ekstraksi teks yang idempotent: jika panggilan utama belum menjawab
+# setelah ambang persentil latensi, kirim panggilan cadangan dan ambil jawaban pertama.
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# Maksimal rasio request yang boleh di-hedge (biaya tambahan), misalnya 0.1 = 10%
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "300"))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "3000"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "16")), thread_name_prefix="hedge")
+
+
+class Hedger:
+    """
+    Tracks latencies of a call site, decides the adaptive hedge delay and keeps
+    the hedge budget and statistics.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._latencies = deque(maxlen=HEDGE_WINDOW)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.saved_ms_total = 0.0
+
+    def record_latency(self, latency_ms: float):
+        with self._lock:
+            self._latencies.append(latency_ms)
+
+    def delay_ms(self) -> float:
+        """
+        Returns the hedge delay: the configured percentile of recent primary latencies,
+        or a fixed default until enough samples are collected.
+        """
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_MS
+        index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))
+        return max(HEDGE_MIN_DELAY_MS, samples[index])
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.requests * HEDGE_BUDGET:
+                return False
+            self.hedges += 1
+            return True
+
+    def _record_saved(self, saved_ms: float):
+        with self._lock:
+            self.hedge_wins += 1
+            self.saved_ms_total += max(0.0, saved_ms)
+
+    def stats(self) -> dict:
+        delay_ms = self.delay_ms()
+        with self._lock:
+            return {
+                "enabled": HEDGE_ENABLED,
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "latency_saved_ms_total": round(self.saved_ms_total, 1),
+                "latency_saved_ms_avg": round(self.saved_ms_total / self.hedge_wins, 1) if self.hedge_wins else 0.0,
+                "current_delay_ms": round(delay_ms, 1),
+            }
+
+    def call(self, primary, hedge):
+        """
+        Runs primary(); if it has not answered after delay_ms(), runs hedge() as well
+        (within budget) and returns the first successful result. A losing call that has
+        not started yet is cancelled; one already running (a blocking HTTP request) cannot
+        be aborted, so it runs to completion in the pool and its result is discarded.
+        HEDGE_BUDGET bounds that extra cost.
+        """
+        with self._lock:
+            self.requests += 1
+
+        if not HEDGE_ENABLED:
+            started = time.perf_counter()
+            result = primary()
+            self.record_latency((time.perf_counter() - started) * 1000)
+            return result
+
+        started = time.perf_counter()
+        # Salin context agar state per-request (misalnya rekaman) ikut ke thread
+        primary_future = _executor.submit(contextvars.copy_context().run, primary)
+        primary_future.add_done_callback(
+            lambda f: f.cancelled() or self.record_latency((time.perf_counter() - started) * 1000)
+        )
+
+        delay_ms = self.delay_ms()
+        done, _ = wait([primary_future], timeout=delay_ms / 1000)
+        if done or not self._take_budget():
+            return primary_future.result()
+
+        logger.info(f"Hedging {self.name}: primary belum menjawab setelah {delay_ms:.0f} ms, mengirim request cadangan")
+        hedge_future = _executor.submit(contextvars.copy_context().run, hedge)
+        pending = {primary_future, hedge_future}
+        first_error = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+
+                for loser in pending:
+                    loser.cancel()
+                if future is hedge_future:
+                    hedge_done_at = time.perf_counter()
+
+                    # Latensi yang dihemat dihitung saat primary akhirnya selesai; jika primary
+                    # gagal, hedge tidak menghemat apa pun (retry juga akan dibutuhkan)
+                    def record_saved(f):
+                        if not f.cancelled() and f.exception() is None:
+                            self._record_saved((time.perf_counter() - hedge_done_at) * 1000)
+
+                    primary_future.add_done_callback(record_saved)
+                return future.result()
+
+        raise first_error
+
+
+_hedgers = {}
+
+
+def get_hedger(name: str) -> Hedger:
+    hedger = _hedgers.get(name)
+    if hedger is None:
+        hedger = _hedgers.setdefault(name, Hedger(name))
+    return hedger
+
+
+def hedging_stats() -> dict:
+    return {name: hedger.stats() for name, hedger in _hedgers.items()}
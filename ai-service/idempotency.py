@@ -0,0 +1,166 @@
+# idempotency.py
+# Idempotency key (ID pesan WhatsApp) untuk endpoint /process_*. Pesan yang dikirim ulang oleh
+# WhatsApp/gateway atau di-retry oleh worker mendapat hasil pertama, bukan ekstraksi LLM baru.
+# Hasil disimpan di Redis dengan TTL; jika Redis tidak tersedia, disimpan di memori lokal.
+# Key dipisah per pengirim karena ID pesan WhatsApp hanya unik dalam satu chat.
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import redis_client
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_RESULT_TTL = int(os.getenv("IDEMPOTENCY_RESULT_TTL", "86400"))
+# Batas umur penanda "sedang diproses", agar key tidak terkunci selamanya jika proses mati
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "120"))
+# Berapa lama request duplikat menunggu hasil request pertama
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "90"))
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.2"))
+IDEMPOTENCY_LOCAL_MAX = int(os.getenv("IDEMPOTENCY_LOCAL_MAX", "10000"))
+
+PENDING = json.dumps({"status": "pending"})
+# Header respons untuk hasil tersimpan. Hasil disimpan setelah ekstraksi, bukan setelah worker
+# menulis ke Sheet, jadi header ini bukan tanda "sudah dicatat"; worker mendedup penulisan sendiri.
+REPLAY_HEADER = "Idempotent-Replay"
+
+_local = {}
+_lock = threading.Lock()
+_stats = {"requests": 0, "replayed": 0, "waited": 0, "executed": 0}
+
+
+def _count(name: str):
+    with _lock:
+        _stats[name] += 1
+
+
+def _local_cleanup(now: float):
+    expired = [k for k, (_, expires_at) in _local.items() if expires_at <= now]
+    for k in expired:
+        del _local[k]
+    while len(_local) > IDEMPOTENCY_LOCAL_MAX:
+        del _local[next(iter(_local))]
+
+
+def _acquire(key: str) -> bool:
+    """
+    Marks the key as in flight. Returns False when another request already holds it.
+    """
+    client = redis_client.get_client()
+    if client is not None:
+        try:
+            return bool(client.set(key, PENDING, nx=True, ex=IDEMPOTENCY_PENDING_TTL))
+        except Exception as e:
+            redis_client.report_failure(e)
+
+    with _lock:
+        now = time.time()
+        _local_cleanup(now)
+        if key in _local:
+            return False
+        _local[key] = (PENDING, now + IDEMPOTENCY_PENDING_TTL)
+        return True
+
+
+def _get(key: str):
+    client = redis_client.get_client()
+    if client is not None:
+        try:
+            value = client.get(key)
+            return json.loads(value) if value else None
+        except Exception as e:
+            redis_client.report_failure(e)
+
+    with _lock:
+        entry = _local.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return json.loads(entry[0])
+
+
+def _store(key: str, result):
+    value = json.dumps({"status": "done", "result": result}, ensure_ascii=False)
+    client = redis_client.get_client()
+    if client is not None:
+        try:
+            client.set(key, value, ex=IDEMPOTENCY_RESULT_TTL)
+            return
+        except Exception as e:
+            redis_client.report_failure(e)
+
+    with _lock:
+        _local[key] = (value, time.time() + IDEMPOTENCY_RESULT_TTL)
+
+
+def _release(key: str):
+    client = redis_client.get_client()
+    if client is not None:
+        try:
+            client.delete(key)
+        except Exception as e:
+            redis_client.report_failure(e)
+
+    with _lock:
+        _local.pop(key, None)
+
+
+async def _call(fn, *args):
+    # Panggilan Redis bersifat blocking: jalankan di threadpool agar event loop tidak tertahan
+    if redis_client.get_client() is None:
+        return fn(*args)
+    return await run_in_threadpool(fn, *args)
+
+
+async def run(endpoint: str, idempotency_key, fn, sender: str = None):
+    """
+    Runs fn() in the threadpool once per (endpoint, sender, idempotency_key).
+    Returns (result, replayed): repeats get the stored result with replayed=True. The result
+    is stored before the caller acts on it, so replayed does not mean the caller's side
+    effects happened. A repeat whose key is still in flight waits for it, up to
+    IDEMPOTENCY_WAIT, then gets 409. Failures are not stored, so a retry after an error runs again.
+    """
+    if not idempotency_key:
+        return await run_in_threadpool(fn), False
+
+    _count("requests")
+    key = redis_client.key("idempotency", endpoint, sender or "-", idempotency_key)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    waited = False
+
+    while True:
+        if await _call(_acquire, key):
+            break
+
+        entry = await _call(_get, key)
+        if entry is not None and entry["status"] == "done":
+            _count("waited" if waited else "replayed")
+            logger.info(f"Idempotency key {idempotency_key} ({endpoint}, {sender}) sudah diproses, mengembalikan hasil tersimpan")
+            return entry["result"], True
+
+        # Request pertama masih berjalan (atau key baru saja dilepas karena gagal): tunggu
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="Pesan dengan ID ini masih diproses")
+        waited = True
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    _count("executed")
+    try:
+        result = await run_in_threadpool(fn)
+    except BaseException:
+        await _call(_release, key)
+        raise
+    await _call(_store, key, result)
+    return result, False
+
+
+def stats() -> dict:
+    with _lock:
+        result = dict(_stats)
+        result["local_keys"] = len(_local)
+    return result
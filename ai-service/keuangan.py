@@ -1,11 +1,16 @@
 # keuangan.py
-from fastapi import UploadFile, File, APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
+from typing import Optional
 import logging
 import json
-import base64
-from datetime import datetime
+import hedging
+import merchant_memory
+import context_cache
+import receipt_filter
+import streaming
+import pipeline
 
 # Konfigurasi logging
 logging.basicConfig(
@@ -17,9 +22,21 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Versi prompt keuangan, dicatat di setiap rekaman. Naikkan saat prompt diubah.
+PROMPT_VERSION = "keuangan-2"
+
 # Model untuk validasi input teks
 class ExpenseInput(BaseModel):
     text: str
+    user_id: Optional[str] = None  # ID pemanggil (nomor WhatsApp) untuk memori merchant
+
+# Model untuk konfirmasi/koreksi kategori oleh pengguna
+class MemoryConfirmInput(BaseModel):
+    user_id: str
+    text: str
+    kategori: str
+    transaksi: str
+    keterangan: Optional[str] = None
 
 
 class VoiceExpenseInput(BaseModel):
@@ -30,10 +47,6 @@ class ImageExpenseInput(BaseModel):
     image: str  # Base64 encoded image (string)
     caption: str  # Caption text (string)
 
-# Fungsi untuk memanggil API Gemini untuk teks (Keuangan)
-# keuangan.py (bagian yang relevan)
-
-# Fungsi untuk memanggil API Gemini untuk teks (Keuangan)
 # keuangan.py (bagian yang relevan)
 
 ALLOWED_KATEGORI_PNG = [
@@ -44,33 +57,15 @@ ALLOWED_KATEGORI_PNG = [
     "Cicilan Rumah", "Cicilan Kendaraan", "Gaji","Bisnis", "Usaha Sampingan","Dividen","Pendapatan Bunga","Komisi","Pemasukan Lainnya"
 ]
 
-# Fungsi untuk memanggil API Gemini untuk teks (Keuangan)
-def call_gemini_api_keuangan(text: str):
-    """
-    Calls Gemini API to process text input and extract Keuangan transaction details.
-    Returns the result in JSON format.
-    """
-    from dotenv import load_dotenv
-    import os
-    import re
-    import json
-    from datetime import datetime
-    import requests
-
-    load_dotenv()
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        logger.error("GEMINI_API_KEY tidak ditemukan di environment variables")
-        raise Exception("GEMINI_API_KEY tidak ditemukan di environment variables")
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
-    current_date = datetime.now().strftime("%Y-%m-%d")
-
-    kategori_png_str = ", ".join(ALLOWED_KATEGORI_PNG)
-    prompt = f"""
-    Dari teks berikut: "{text}"
+# State prompt dan parser dimuat sekali saat import, bukan di setiap request
+KATEGORI_PNG_STR = ", ".join(ALLOWED_KATEGORI_PNG)
+
+# Prompt teks keuangan untuk Gemini
+def keuangan_text_prompt(inp: dict, current_date: str) -> str:
+    return f"""
+    Dari teks berikut: "{inp['text']}"
         Tentukan:
-        1. kategori (pilih dari: {kategori_png_str}) jika peengeluaran, jika pendapatan pilih dari: Gaji, Bisnis, Usaha Sampingan, Dividen, Pendapatan Bunga, Komisi, Pemasukan Lainnya
+        1. kategori (pilih dari: {KATEGORI_PNG_STR}) jika peengeluaran, jika pendapatan pilih dari: Gaji, Bisnis, Usaha Sampingan, Dividen, Pendapatan Bunga, Komisi, Pemasukan Lainnya
         2. Tipe Transaksi (pilih dari: Pendapatan, Pengeluaran, Tagihan, Investasi, Cicilan)
         3. Ekstrak "Nominal":
         - Jika ditemukan angka dengan atau tanpa satuan (seperti: "500000", "5jt", "300 ribu"):
@@ -104,76 +99,12 @@ def call_gemini_api_keuangan(text: str):
         }}
     """
 
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }]
-    }
-
-    headers = {
-        "Content-Type": "application/json"
-    }
-
-    try:
-        logger.info(f"Memanggil Gemini API untuk teks: {text}")
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-
-        generated_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-        json_match = re.search(r'```json\n(.*?)\n```', generated_text, re.DOTALL)
-        if not json_match:
-            logger.error(f"Tidak dapat menemukan JSON dalam respons Gemini: {generated_text}")
-            raise Exception("Tidak dapat menemukan JSON dalam respons Gemini")
-
-        json_str = json_match.group(1)
-        data = json.loads(json_str)
-
-        if "note" in data:
-            logger.info(f"Gemini mengembalikan note: {data['note']}")
-            return {"note": data["note"]}
-
-        response_data = {
-            "kategori": data.get("kategori", "Lain-lain"),
-            "transaksi": data.get("transaksi", "Pengeluaran"),
-            "nominal": data.get("nominal", 0),
-            "tanggal": data.get("tanggal", current_date),
-            "keterangan": data.get("keterangan", "Tidak spesifik")
-        }
-
-        logger.info(f"Hasil dari Gemini API: {response_data}")
-        return response_data
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-        raise Exception(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-    except json.JSONDecodeError as e:
-        logger.error(f"Error saat mem-parsing JSON dari respons Gemini: {str(e)}, Teks: {generated_text}")
-        raise Exception(f"Error saat mem-parsing JSON dari respons Gemini: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error saat memproses respons Gemini (teks keuangan): {str(e)}")
-        raise Exception(f"Error saat memproses respons Gemini: {str(e)}")
-
-    
-# Fungsi untuk memanggil DeepSeek API untuk teks (Keuangan)
-def call_deepseek_api_keuangan(text: str):
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-
-    api_key = os.getenv("DEEPSEEK_API_KEY")
-    if not api_key:
-        logger.error("DEEPSEEK_API_KEY tidak ditemukan di environment variables")
-        raise Exception("DEEPSEEK_API_KEY tidak ditemukan di environment variables")
-
-    url = "https://api.deepseek.com/chat/completions"
-    current_date = datetime.now().strftime("%Y-%m-%d")
-    
-    kategori_str = ", ".join(ALLOWED_KATEGORI)
-    prompt = f"""
-     Dari teks berikut: "{text}"
+# Prompt teks keuangan untuk DeepSeek (provider hedge)
+def deepseek_text_prompt(inp: dict, current_date: str) -> str:
+    return f"""
+     Dari teks berikut: "{inp['text']}"
         Tentukan:
-        1. kategori (pilih dari: {kategori_str})
+        1. kategori (pilih dari: {KATEGORI_PNG_STR})
         2. Tipe Transaksi (pilih dari: Pendapatan, Pengeluaran, Tagihan, Investasi, Cicilan)
         3. Ekstrak "Nominal":
         - Jika ditemukan angka dengan atau tanpa satuan (seperti: "500000", "5jt", "300 ribu"):
@@ -207,87 +138,16 @@ def call_deepseek_api_keuangan(text: str):
         }}
     """
 
-    payload = {
-        "model": "deepseek-chat",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt.strip()}
-        ],
-        "stream": False
-    }
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-
-    try:
-        logger.info(f"Memanggil DeepSeek API untuk teks: {text}")
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        response.raise_for_status()
-        result = response.json()
-        generated_text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-
-        import re
-        json_match = re.search(r'```json\n(.*?)\n```', generated_text, re.DOTALL)
-        if not json_match:
-            logger.error(f"Tidak dapat menemukan JSON dalam respons DeepSeek: {generated_text}")
-            raise Exception("Tidak dapat menemukan JSON dalam respons DeepSeek")
-
-        json_str = json_match.group(1)
-        data = json.loads(json_str)
-        
-        if "note" in data:
-            logger.info(f"Gemini mengembalikan note: {data['note']}")
-            return {"note": data["note"]}
-    
-        response_data = {
-            "kategori": data.get("kategori", "Lain-lain"),
-            "transaksi": data.get("transaksi", "Pengeluaran"),
-            "nominal": data.get("nominal", 0),
-            "tanggal": data.get("tanggal", current_date),
-            "keterangan": data.get("keterangan", "Tidak spesifik")
-        }
-
-        logger.info(f"Hasil dari DeepSeek API: {response_data}")
-        return response_data
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error jaringan saat memanggil DeepSeek API: {str(e)}")
-        raise Exception(f"Error jaringan saat memanggil DeepSeek API: {str(e)}")
-    except json.JSONDecodeError as e:
-        logger.error(f"Gagal parsing JSON dari respons DeepSeek: {str(e)}")
-        raise Exception(f"Gagal parsing JSON dari respons DeepSeek: {str(e)}")
-    except Exception as e:
-        logger.error(f"Kesalahan saat memproses respons DeepSeek: {str(e)}")
-        raise Exception(f"Kesalahan saat memproses respons DeepSeek: {str(e)}")
-    
-# Fungsi untuk memanggil API Gemini untuk gambar dan caption (Keuangan)
-# keuangan.py (bagian yang relevan)
-# Fungsi untuk memanggil API Gemini untuk gambar dan caption (Keuangan)
-def call_gemini_image_api_keuangan(image_base64: str, caption: str):
-    logger.info("Masuk ke fungsi call_gemini_image_api_keuangan")
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        logger.error("GEMINI_API_KEY tidak ditemukan di environment variables")
-        raise Exception("GEMINI_API_KEY tidak ditemukan di environment variables")
-
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
+NOT_RECEIPT_NOTE = "Gambar ini bukan struk belanja."
 
-    current_date = datetime.now().strftime("%Y-%m-%d")
-
-    kategori_png_str = ", ".join(ALLOWED_KATEGORI_PNG)
-    prompt = f"""
+# Bagian statis prompt gambar keuangan (tidak bergantung pada caption/tanggal) yang disimpan di context cache
+KEUANGAN_IMAGE_STATIC_PROMPT = f"""
     Ambil data transaksi dari gambar struk ini. Untuk tiap item, berikan:
-    1. kategori (pilih dari: {kategori_png_str})
+    1. kategori (pilih dari: {KATEGORI_PNG_STR})
     2. tipe_transaksi: Pendapatan / Pengeluaran / Tagihan / Investasi / Cicilan
     3. nominal: angka bulat, hilangkan Rp, titik, koma. Diskon = nilai negatif. Abaikan "Total", "Subtotal", dll.
-    4. Keterangan (barang/jasa spesifik seperti yang tertulis) atau dari {caption} jika ada.
-    5. tanggal: format YYYY-MM-DD, pakai hari ini jika tidak ada tanggal
+    4. Keterangan (barang/jasa spesifik seperti yang tertulis) atau dari caption (lihat bagian "Caption" di akhir) jika ada.
+    5. tanggal: format YYYY-MM-DD, pakai tanggal hari ini (lihat bagian "Tanggal hari ini" di akhir) jika tidak ada tanggal
 
     Instruksi tambahan:
     - Asumsikan struk adalah BUKTI PEMBELIAN oleh pengguna, jadi semua transaksi bertipe "Pengeluaran".
@@ -314,213 +174,158 @@ def call_gemini_image_api_keuangan(image_base64: str, caption: str):
     Jika gambar bukan struk, jawab:
     {{
     "transactions": [],
-    "note": "Gambar ini bukan struk belanja."
+    "note": "{NOT_RECEIPT_NOTE}"
     }}
     """
 
+# Prompt analisis voice note (statis)
+VOICE_PROMPT = """
+    Analisis konten dari voice note berikut.
+    Apakah ada diskusi yang berkaitan dengan transaksi keuangan, seperti:
+    - Pembelian atau penjualan barang/jasa?
+    - Pembayaran atau transfer uang?
+    - Penyebutan harga, jumlah, atau total biaya?
+    - Konfirmasi pesanan atau kesepakatan jual beli?
 
-    payload = {
-        "contents": [{
-            "parts": [
-                {"text": prompt},
-                {
-                    "inlineData": {
-                        "mimeType": "image/jpeg",
-                        "data": image_base64
-                    }
-                }
-            ]
-        }]
-    }
-
-    headers = {
-        "Content-Type": "application/json"
-    }
+    Jika ada, berikan ringkasan singkat mengenai indikasi transaksi tersebut.
+    Jika tidak ada, balas "Tidak ditemukan transaksi yang relevan."
+    """
 
-    try:
-        logger.info("Memanggil Gemini API untuk gambar dan caption keuangan")
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        response.raise_for_status()
-        result = response.json()
-
-        generated_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
-
-        logger.info(f"Respons mentah dari Gemini (gambar keuangan): {generated_text}")
-
-        cleaned_text = generated_text
-        if cleaned_text.startswith("```json"):
-            cleaned_text = generated_text[7:-3].strip()
-        elif cleaned_text.startswith("```"):
-            cleaned_text = generated_text[3:-3].strip()
-
-        parsed_result = json.loads(cleaned_text)
-
-        if isinstance(parsed_result, list):
-            logger.warning("⚠️ Respons Gemini berupa list langsung, tidak dalam object dengan key 'transactions'")
-            return {
-                "transactions": parsed_result,
-                "note": None
-            }
-
-        elif isinstance(parsed_result, dict):
-            transactions_raw = parsed_result.get("transactions", [])
-            note = parsed_result.get("note")
-            return {
-                "transactions": transactions_raw,
-                "note": note
-            }
-
-        else:
-            raise Exception("Struktur JSON dari Gemini tidak valid atau tidak dikenali")
-
-    except json.JSONDecodeError as e:
-        logger.error(f"Gagal mem-parse JSON: {cleaned_text}. Error: {e}")
-        raise Exception(f"Respons JSON tidak valid dari Gemini API: {str(e)}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-        raise Exception(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error tak terduga saat memanggil Gemini Image API: {str(e)}")
-        raise Exception(f"Error tak terduga saat memanggil Gemini Image API: {str(e)}")
+# Skema field transaksi keuangan (teks dan gambar)
+KEUANGAN_TEXT_SCHEMA = pipeline.Schema([
+    pipeline.Field("kategori", "str", "Lain-lain"),
+    pipeline.Field("transaksi", "str", "Pengeluaran"),
+    pipeline.Field("nominal", "number", 0),
+    pipeline.Field("tanggal", "date"),
+    pipeline.Field("keterangan", "str", "Tidak spesifik"),
+])
+KEUANGAN_IMAGE_SCHEMA = pipeline.Schema([
+    pipeline.Field("kategori", "str", "Lain-lain"),
+    pipeline.Field("tipe_transaksi", "str", "Pengeluaran"),
+    pipeline.Field("nominal", "number", 0),
+    pipeline.Field("tanggal", "date"),
+    pipeline.Field("keterangan", "str"),
+], keep_extra=True)
+
+# Merchant yang sudah dikenal untuk pelanggan ini dikategorikan tanpa memanggil LLM
+def lookup_merchant_memory(inp: dict):
+    result = merchant_memory.resolve(inp.get("user_id"), inp["text"])
+    if result is None:
+        return None
+    return {"transactions": [result], "note": None}
+
+# Gambar yang jelas bukan struk langsung dijawab tanpa memanggil vision API
+def prefilter_receipt(inp: dict):
+    prefilter = receipt_filter.check_image(inp["image_bytes"])
+    if prefilter["is_receipt"]:
+        return None
+    logger.info(f"Pre-filter menolak gambar ({prefilter['reason']}, skor {prefilter['score']}): {prefilter.get('features')}")
+    return {"transactions": [], "note": NOT_RECEIPT_NOTE}
+
+# Ekstraksi teks keuangan dengan hedging: request cadangan dikirim ke DeepSeek jika tersedia,
+# jika tidak ke Gemini lagi. Aman karena ekstraksi teks bersifat idempotent.
+KEUANGAN_TEXT = pipeline.Pipeline(
+    "process_expense_keuangan",
+    PROMPT_VERSION,
+    provider=pipeline.GeminiText(keuangan_text_prompt),
+    hedge=pipeline.DeepSeekChat(deepseek_text_prompt),
+    parse=pipeline.parse_json_block,
+    schema=KEUANGAN_TEXT_SCHEMA,
+    decode=pipeline.decode_text,
+    lookup=lookup_merchant_memory,
+)
+
+KEUANGAN_IMAGE = pipeline.Pipeline(
+    "process_image_expense_keuangan",
+    PROMPT_VERSION,
+    provider=pipeline.GeminiCachedImage("keuangan_image", KEUANGAN_IMAGE_STATIC_PROMPT),
+    parse=pipeline.parse_json,
+    schema=KEUANGAN_IMAGE_SCHEMA,
+    record_fields=("image", "caption"),
+    decode=pipeline.decode_image,
+    fast_path=prefilter_receipt,
+    error_label="memproses gambar",
+)
+
+KEUANGAN_VOICE = pipeline.Pipeline(
+    "process_voice_expense_keuangan",
+    PROMPT_VERSION,
+    provider=pipeline.GeminiVoice(VOICE_PROMPT),
+    parse=pipeline.parse_summary,
+    record_fields=("file_base64",),
+    error_label="memproses voice note",
+)
 
 
 # Endpoint untuk memproses pengeluaran (teks) - Keuangan
 @router.post("/process_expense_keuangan")
-async def process_expense_keuangan(input: ExpenseInput):
+async def process_expense_keuangan(input: ExpenseInput, response: Response, idempotency_key: Optional[str] = Header(None),
+                                   x_sender_id: Optional[str] = Header(None)):
     """
     Processes text input to extract Keuangan transaction details using Gemini API.
+    The Idempotency-Key header (WhatsApp message id) deduplicates redelivered messages of
+    the same sender (X-Sender-Id, or user_id); a stored result is marked with Idempotent-Replay: true.
     """
-    text = input.text.strip()
-    
-    if not text:
-        raise HTTPException(status_code=400, detail="Teks tidak boleh kosong")
-
-    try:
-        result = call_gemini_api_keuangan(text)
-
-        # Jika hasil berupa note, kembalikan langsung
-        if "note" in result:
-            return {"transactions": [], "note": result["note"]}
-
-        # Jika hasil transaksi valid
-        return {
-            "transactions": [result],
-            "note": None
-        }
-
-    except Exception as e:
-        logger.error(f"Error memproses input teks '{text}': {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat memproses teks: {str(e)}")
+    return await KEUANGAN_TEXT.handle(input.dict(), idempotency_key, x_sender_id or input.user_id, response)
 
 
 
 # Endpoint untuk memproses pengeluaran (gambar dan caption) - Keuangan
 @router.post("/process_image_expense_keuangan")
-async def process_image_expense_keuangan(input: ImageExpenseInput):
-    logger.info("Masuk ke endpoint process_image_expense_keuangan")
+async def process_image_expense_keuangan(input: ImageExpenseInput, response: Response, idempotency_key: Optional[str] = Header(None),
+                                         x_sender_id: Optional[str] = Header(None)):
     """
     Processes image and caption input to extract Keuangan transaction details using Gemini Vision API.
     """
+    logger.info("Masuk ke endpoint process_image_expense_keuangan")
+    return await KEUANGAN_IMAGE.handle(input.dict(), idempotency_key, x_sender_id, response)
+
+# Endpoint streaming: setiap transaksi dikirim (NDJSON) begitu selesai di-parse dari respons Gemini
+@router.post("/process_image_expense_keuangan_stream")
+def process_image_expense_keuangan_stream(input: ImageExpenseInput):
+    """
+    Streaming variant of /process_image_expense_keuangan for multi-item receipts.
+    Streamed calls are not recorded and not deduplicated by Idempotency-Key.
+    """
+    logger.info("Masuk ke endpoint process_image_expense_keuangan_stream")
     try:
-        result = call_gemini_image_api_keuangan(input.image, input.caption)
-
-        # Jika hasil berupa dict dengan transactions dan note
-        if isinstance(result, dict):
-            transactions = result.get("transactions", [])
-            note = result.get("note")
-            return {
-                "transactions": transactions,
-                "note": note
-            }
-        else:
-            # Backward compatibility jika hanya list dikembalikan
-            return {"transactions": result}
+        lines = KEUANGAN_IMAGE.stream(input.dict())
     except Exception as e:
-        logger.error(f"Error memproses gambar: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat memproses gambar: {str(e)}")
+    return StreamingResponse(lines, media_type=streaming.NDJSON_MEDIA_TYPE)
+
+# Statistik hedging (hedge rate dan latensi yang dihemat)
+@router.get("/stats/hedging")
+async def hedging_stats():
+    return hedging.hedging_stats()
+
+# Konfirmasi atau koreksi kategori dari pengguna untuk memori merchant
+@router.post("/memory/confirm")
+async def confirm_merchant_memory(input: MemoryConfirmInput):
+    if input.kategori not in ALLOWED_KATEGORI_PNG:
+        raise HTTPException(status_code=400, detail=f"Kategori tidak dikenal: {input.kategori}")
+    merchant_memory.confirm(input.user_id, input.text, input.kategori, input.transaksi, input.keterangan)
+    return {"status": "OK"}
+
+# Statistik context cache (latensi dan token input yang ditagih, cached vs prompt penuh)
+@router.get("/stats/context_cache")
+async def context_cache_stats():
+    return context_cache.stats()
+
+# Statistik pre-filter gambar struk
+@router.get("/stats/prefilter")
+async def prefilter_stats():
+    return receipt_filter.stats()
+
+# Statistik memori merchant (hit rate)
+@router.get("/stats/memory")
+async def merchant_memory_stats():
+    return merchant_memory.stats()
 
 @router.post("/process_voice_expense_keuangan")
-async def process_voice_expense_keuangan(input: VoiceExpenseInput):
-    try:
-        result = call_gemini_voice_api_keuangan(input.file_base64)
-        return result
-    except Exception as e:
-        logger.error(f"Error memproses voice note: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat memproses voice note: {str(e)}")
-    
-def call_gemini_voice_api_keuangan(file_base64: str):
-    from dotenv import load_dotenv
-    import os
-    load_dotenv()
-
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        logger.error("GEMINI_API_KEY tidak ditemukan di environment variables")
-        raise Exception("GEMINI_API_KEY tidak ditemukan di environment variables")
-
-    # 1. Upload file to Gemini File API
-    file_upload_url = f"https://generativelanguage.googleapis.com/v1beta/files?key={api_key}"
-    upload_headers = {"Content-Type": "application/json"}
-    upload_payload = {
-        "file": {
-            "mimeType": "audio/mp3",
-            "data": file_base64
-        }
-    }
-
-    try:
-        logger.info("Mengunggah file audio ke File API Gemini")
-        upload_response = requests.post(file_upload_url, json=upload_payload, headers=upload_headers)
-        upload_response.raise_for_status()
-        file_result = upload_response.json()
-        file_uri = file_result.get("name")  # e.g. "files/xxxx"
-        if not file_uri:
-            raise Exception("Upload file berhasil tapi file_uri tidak ditemukan")
-    except Exception as e:
-        logger.error(f"Gagal mengunggah file ke Gemini: {str(e)}")
-        raise
-
-    # 2. Kirim prompt dan fileUri ke generateContent
-    gen_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
-
-    prompt = """
-    Analisis konten dari voice note berikut.
-    Apakah ada diskusi yang berkaitan dengan transaksi keuangan, seperti:
-    - Pembelian atau penjualan barang/jasa?
-    - Pembayaran atau transfer uang?
-    - Penyebutan harga, jumlah, atau total biaya?
-    - Konfirmasi pesanan atau kesepakatan jual beli?
-
-    Jika ada, berikan ringkasan singkat mengenai indikasi transaksi tersebut.
-    Jika tidak ada, balas "Tidak ditemukan transaksi yang relevan."
-    """
-
-    gen_payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt},
-                    {
-                        "fileData": {
-                            "mimeType": "audio/mp3",
-                            "fileUri": file_uri
-                        }
-                    }
-                ]
-            }
-        ]
-    }
-
-    try:
-        logger.info("Memanggil Gemini API dengan fileUri untuk analisis voice note")
-        response = requests.post(gen_url, json=gen_payload, headers=upload_headers)
-        response.raise_for_status()
-        result = response.json()
-        generated_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
-        return {"summary": generated_text}
-    except Exception as e:
-        logger.error(f"Gagal memproses voice note dengan Gemini: {str(e)}")
-        raise
+async def process_voice_expense_keuangan(input: VoiceExpenseInput, response: Response, idempotency_key: Optional[str] = Header(None),
+                                         x_sender_id: Optional[str] = Header(None)):
+    return await KEUANGAN_VOICE.handle(input.dict(), idempotency_key, x_sender_id, response)
     
 # Fungsi untuk menghasilkan perintah curl
 def generate_curl_command(url: str, headers: dict, payload: dict) -> str:
@@ -539,4 +344,4 @@ def generate_curl_command(url: str, headers: dict, payload: dict) -> str:
     payload_str = json.dumps(payload, ensure_ascii=False).replace("'", "'\\''")
     curl_cmd += f" -d '{payload_str}'"
     
-    return curl_cmd
\ No newline at end of file
+    return curl_cmd
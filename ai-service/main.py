@@ -1,15 +1,26 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+import time
+_IMPORT_STARTED_AT = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import re
-import requests
 import logging
-import json
-import base64
+import hmac
 from dotenv import load_dotenv
 import os
-from datetime import datetime
+from typing import Optional
 from keuangan import router as keuangan_router  # Impor router dari keuangan.py
+import keuangan
+import providers
+import recorder
+import redis_client
+import context_cache
+import idempotency
+import streaming
+import pipeline
+import timing
+import profiling
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,17 +32,110 @@ logging.basicConfig(
     handlers=[logging.StreamHandler()]
 )
 logger = logging.getLogger(__name__)
+timing.instrument_logging()
 
 app = FastAPI()
 
 # Sertakan router dari keuangan.py
 app.include_router(keuangan_router)
 
-# Health check endpoint
+# Timer per tahap untuk setiap request: dikirim di header Server-Timing dan dicatat di log.
+# Untuk endpoint streaming, header hanya memuat tahap sebelum stream dimulai.
+# Health check dipoll terus oleh docker/orchestrator, jadi tidak diukur dan tidak dicatat.
+UNTIMED_PATHS = {"/health", "/ready"}
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    if request.url.path in UNTIMED_PATHS:
+        return await call_next(request)
+    started = time.perf_counter()
+    timings = timing.start_request()
+    response = await call_next(request)
+    total_ms = (time.perf_counter() - started) * 1000
+    response.headers["Server-Timing"] = timing.server_timing_header(timings, total_ms)
+    logger.info(
+        f"{request.method} {request.url.path} {response.status_code} {total_ms:.1f} ms - {response.headers['Server-Timing']}",
+        extra={"timings": dict(timings), "total_ms": round(total_ms, 1)},
+    )
+    return response
+
+# Batas waktu (ms) sebelum import/startup dianggap lambat
+SLOW_IMPORT_MS = float(os.getenv("SLOW_IMPORT_MS", "2000"))
+SLOW_STARTUP_MS = float(os.getenv("SLOW_STARTUP_MS", "5000"))
+
+startup_timing = {
+    "import_ms": round((time.perf_counter() - _IMPORT_STARTED_AT) * 1000, 1),
+    "startup_ms": None,
+}
+
+# Pipeline yang harus terdaftar dengan prompt yang bisa disusun sebelum service dianggap siap
+REQUIRED_PIPELINES = (
+    "process_expense_lm",
+    "process_image_expense_lm",
+    "process_expense_keuangan",
+    "process_image_expense_keuangan",
+    "process_voice_expense_keuangan",
+)
+prompt_state = {"loaded": False}
+
+# Prewarm koneksi provider dan muat state prompt/parser sebelum menerima request
+@app.on_event("startup")
+def startup():
+    started = time.perf_counter()
+    if startup_timing["import_ms"] > SLOW_IMPORT_MS:
+        logger.warning(f"Import lambat: {startup_timing['import_ms']} ms (batas {SLOW_IMPORT_MS} ms)")
+
+    if recorder.RECORD_MODE == "replay":
+        providers.use_replay_keys()
+    provider_statuses = providers.prewarm_all()
+    for name, status in provider_statuses.items():
+        logger.info(f"Prewarm provider {name}: {status}")
+    if recorder.RECORD_MODE != "replay":
+        providers.start_reconnect()
+
+    missing = [name for name in REQUIRED_PIPELINES if name not in pipeline.PIPELINES]
+    if missing:
+        logger.error(f"Pipeline belum terdaftar: {missing}")
+    prompt_state["loaded"] = not missing and all(pipeline.PIPELINES[name].prompt_loaded() for name in REQUIRED_PIPELINES)
+
+    # Unggah bagian statis prompt gambar ke context cache sebelum request pertama
+    if provider_statuses["gemini"]["connected"]:
+        api_key = os.getenv("GEMINI_API_KEY")
+        context_cache.get_handle("lm_image", LM_IMAGE_STATIC_PROMPT, api_key)
+        context_cache.get_handle("keuangan_image", keuangan.KEUANGAN_IMAGE_STATIC_PROMPT, api_key)
+
+    startup_timing["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if startup_timing["startup_ms"] > SLOW_STARTUP_MS:
+        logger.warning(f"Startup lambat: {startup_timing['startup_ms']} ms (batas {SLOW_STARTUP_MS} ms)")
+    logger.info(f"Startup selesai - import: {startup_timing['import_ms']} ms, startup: {startup_timing['startup_ms']} ms")
+
+# Health check endpoint (liveness)
 @app.get("/health")
 async def health_check():
     return {"status": "OK"}
 
+# Readiness endpoint: provider terkoneksi dan state prompt/parser sudah dimuat. Hanya membaca
+# status yang tersimpan (prewarm ulang berjalan di background), jadi polling tidak memicu I/O jaringan.
+@app.get("/ready")
+def readiness_check():
+    provider_statuses = providers.provider_status()
+    prompts_loaded = prompt_state["loaded"]
+    # Dalam mode replay provider tidak dipanggil, jadi tidak perlu terkoneksi
+    providers_ok = recorder.RECORD_MODE == "replay" or providers.providers_ready(provider_statuses)
+    ready = startup_timing["startup_ms"] is not None and prompts_loaded and providers_ok
+
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "providers": provider_statuses,
+        "prompts": {"loaded": prompts_loaded},
+        "cache": {"redis": redis_client.status()},
+        "timing": startup_timing,
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+# Versi prompt LM, dicatat di setiap rekaman. Naikkan saat prompt diubah.
+PROMPT_VERSION = "lm-2"
+
 # Model untuk validasi input teks
 class ExpenseInput(BaseModel):
     text: str
@@ -41,24 +145,10 @@ class ImageExpenseInput(BaseModel):
     image: str  # Base64 encoded image (string)
     caption: str  # Caption text (string)
 
-# Fungsi untuk memanggil API Gemini untuk teks (Logam Mulia)
-def call_gemini_api(text: str):
-    """
-    Calls Gemini API to process text input and extract LM transaction details, including date.
-    Handles cases where Nominal is missing by returning partial data.
-    """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        logger.error("GEMINI_API_KEY tidak ditemukan di environment variables")
-        raise Exception("GEMINI_API_KEY tidak ditemukan di environment variables")
-        
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
-    
-    # Tanggal saat ini untuk default
-    current_date = datetime.now().strftime("%Y-%m-%d")
-    
-    prompt = f"""
-    Analisis teks berikut untuk mengidentifikasi transaksi logam mulia: "{text}"
+# Prompt teks LM (bagian statis dan dinamis dalam satu teks)
+def lm_text_prompt(inp: dict, current_date: str) -> str:
+    return f"""
+    Analisis teks berikut untuk mengidentifikasi transaksi logam mulia: "{inp['text']}"
 
     Teks masukan diharapkan mengikuti pola: [Jenis LM] [Berat]g [Nominal] [Qty] [Tujuan Savings], dengan kemungkinan informasi tambahan seperti tanggal pembelian.
     Contoh format: Antam 5g 5000k 1 Dana Darurat
@@ -84,92 +174,8 @@ def call_gemini_api(text: str):
     Pastikan angka untuk Berat, Nominal, dan Qty hanya angka tanpa teks tambahan, dan Tanggal dalam format YYYY-MM-DD. Jika Nominal tidak ada, tetapkan ke 0 dan lanjutkan parsing data lainnya.
     """
 
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }]
-    }
-    
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
-    try:
-        logger.info(f"Memanggil Gemini API untuk teks: {text}")
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        result = response.json()
-        
-        generated_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
-        
-        logger.info(f"Respons mentah dari Gemini (teks): {generated_text}")
-
-        if generated_text.lower().startswith("error:"):
-            error_message = generated_text.split(":", 1)[1].strip()
-            logger.warning(f"Gemini returned explicit error: {error_message}")
-            return {"error": error_message} 
-        
-        lines = generated_text.split('\n')
-        parsed_data = {}
-        for line in lines:
-            if ': ' in line:
-                key, value = line.split(': ', 1)
-                parsed_data[key.strip()] = value.strip()
-
-        jenis_lm = parsed_data.get('Jenis LM', 'Merk Lain')
-        tabel_savings = parsed_data.get('Tabel Savings', 'Tidak Berlaku')
-        tanggal = parsed_data.get('Tanggal', current_date)
-        
-        try:
-            berat = float(parsed_data.get('Berat', 0))
-        except (ValueError, TypeError):
-            logger.warning(f"Gagal mengkonversi Berat '{parsed_data.get('Berat')}' menjadi float. Menggunakan nilai default 0.0")
-            berat = 0.0
-
-        try:
-            nominal = float(parsed_data.get('Nominal', 0))
-        except (ValueError, TypeError):
-            logger.warning(f"Gagal mengkonversi Nominal '{parsed_data.get('Nominal')}' menjadi float. Menggunakan nilai default 0")
-            nominal = 0.0
-
-        try:
-            qty = int(parsed_data.get('Qty', 1))
-        except (ValueError, TypeError):
-            logger.warning(f"Gagal mengkonversi Qty '{parsed_data.get('Qty')}' menjadi int. Menggunakan nilai default 1")
-            qty = 1
-
-        logger.info(f"Hasil parsing - Jenis LM: {jenis_lm}, Berat: {berat}, Nominal: {nominal}, Qty: {qty}, Tabel Savings: {tabel_savings}, Tanggal: {tanggal}")
-        
-        return {
-            "jenis_lm": jenis_lm,
-            "berat": berat,
-            "nominal": nominal,
-            "qty": qty,
-            "tabel_savings": tabel_savings,
-            "tanggal": tanggal
-        }
-    
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-        raise Exception(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error saat memproses respons Gemini (teks): {str(e)}")
-        raise Exception(f"Error saat memproses respons Gemini: {str(e)}")
-
-# Fungsi untuk memanggil API Gemini untuk gambar dan caption (Logam Mulia)
-def call_gemini_image_api(image_base64: str, caption: str):
-    logger.info("Masuk ke fungsi call_gemini_image_api")
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        logger.error("GEMINI_API_KEY tidak ditemukan di environment variables")
-        raise Exception("GEMINI_API_KEY tidak ditemukan di environment variables")
-        
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
-    
-    # Tanggal saat ini untuk default
-    current_date = datetime.now().strftime("%Y-%m-%d")
-    
-    example_json = """
+# Bagian statis prompt gambar LM (tidak bergantung pada caption/tanggal) yang disimpan di context cache
+LM_IMAGE_EXAMPLE_JSON = """
     {
       "transactions": [
         {
@@ -183,10 +189,10 @@ def call_gemini_image_api(image_base64: str, caption: str):
       ]
     }
     """
-    empty_json_example = '{"transactions": []}'
-    prompt = f"""
+LM_IMAGE_EMPTY_JSON = '{"transactions": []}'
+LM_IMAGE_STATIC_PROMPT = f"""
     Analisis gambar ini (misalnya, struk pembelian logam mulia) dan ekstrak detail setiap transaksi terpisah.
-    Gunakan caption untuk informasi tambahan: "{caption}"
+    Gunakan caption (lihat bagian "Caption" di akhir) untuk informasi tambahan.
 
     Untuk setiap item/transaksi yang terdeteksi, identifikasi:
     - "Jenis LM" dari daftar berikut: Antam, UBS, PAMP, Galeri24, Wonderful Wish, Big Gold, Lotus Archi, Hartadinata, King Halim, Antam Retro, Semar Nusantara. Jika tidak ada di daftar atau tidak jelas, gunakan "Merk Lain". Jika diawali "emas ", abaikan "emas ".
@@ -197,158 +203,118 @@ def call_gemini_image_api(image_base64: str, caption: str):
     - "Tanggal" pembelian: 
       - Cari tanggal pembelian dari gambar (misalnya, pada struk).
       - Jika tidak ada di gambar, cari di caption (contoh: "pembelian tanggal 11 Januari 2010").
-      - Jika tidak ada di gambar maupun caption, gunakan tanggal saat ini ({current_date}) sebagai default.
+      - Jika tidak ada di gambar maupun caption, gunakan tanggal hari ini (lihat bagian "Tanggal hari ini" di akhir) sebagai default.
       - Konversi tanggal ke format YYYY-MM-DD (contoh: 2010-01-11).
-      - Jika tanggal tidak valid (misalnya, di masa depan dibandingkan {current_date}, atau format salah), kembalikan: Error: Tanggal tidak valid.
+      - Jika tanggal tidak valid (misalnya, di masa depan dibandingkan tanggal hari ini, atau format salah), kembalikan: Error: Tanggal tidak valid.
 
     Sajikan semua detail transaksi dalam format JSON yang valid.
     Struktur JSON harus berupa objek tunggal dengan kunci "transactions" yang berisi array objek transaksi.
     Setiap objek dalam array "transactions" harus memiliki kunci: "jenis_lm" (string), "berat" (number), "nominal" (number), "qty" (integer), "tabel_savings" (string), "tanggal" (string dalam format YYYY-MM-DD).
 
     Contoh format JSON yang diharapkan:
-    {example_json}
+    {LM_IMAGE_EXAMPLE_JSON}
     
-    Jika tidak ada transaksi yang terdeteksi dalam gambar, kembalikan JSON dengan array kosong: {empty_json_example}
+    Jika tidak ada transaksi yang terdeteksi dalam gambar, kembalikan JSON dengan array kosong: {LM_IMAGE_EMPTY_JSON}
 
     Pastikan respons Anda HANYA JSON yang valid, tanpa teks penjelasan atau markdown formatting (seperti ```json```) di luar blok JSON itu sendiri.
     """
 
-    payload = {
-        "contents": [{
-            "parts": [
-                {"text": prompt},
-                {
-                    "inlineData": {
-                        "mimeType": "image/jpeg",
-                        "data": image_base64
-                    }
-                }
-            ]
-        }]
-    }
-
-    headers = {
-        "Content-Type": "application/json"
-    }
+# Skema field transaksi LM. Respons teks memakai label "Jenis LM: ..." sebagai key,
+# respons gambar memakai key JSON.
+LM_FIELDS = [
+    ("jenis_lm", "str", "Merk Lain", "Jenis LM"),
+    ("berat", "float", 0.0, "Berat"),
+    ("nominal", "float", 0.0, "Nominal"),
+    ("qty", "int", 1, "Qty"),
+    ("tabel_savings", "str", "Tidak Berlaku", "Tabel Savings"),
+    ("tanggal", "date", None, "Tanggal"),
+]
+LM_TEXT_SCHEMA = pipeline.Schema([pipeline.Field(name, kind, default, source) for name, kind, default, source in LM_FIELDS])
+LM_IMAGE_SCHEMA = pipeline.Schema([pipeline.Field(name, kind, default) for name, kind, default, _ in LM_FIELDS])
+
+# Respons endpoint teks LM: satu transaksi, atau 400 jika Gemini menolak input
+def respond_lm_text(result: dict):
+    if "error" in result:
+        logger.warning(f"Gemini mengembalikan error eksplisit: {result['error']}")
+        raise HTTPException(status_code=400, detail=f"Kesalahan dari Gemini: {result['error']}")
+    return result["transactions"][0]
+
+LM_TEXT = pipeline.Pipeline(
+    "process_expense_lm",
+    PROMPT_VERSION,
+    provider=pipeline.GeminiText(lm_text_prompt),
+    parse=pipeline.parse_lines,
+    schema=LM_TEXT_SCHEMA,
+    decode=pipeline.decode_text,
+    respond=respond_lm_text,
+)
 
-    try:
-        logger.info("Memanggil Gemini API untuk gambar dan caption")
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        response.raise_for_status()
-        result = response.json()
-        
-        generated_text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
-        
-        logger.info(f"Respons mentah dari Gemini (gambar): {generated_text}")
-
-        cleaned_text = generated_text
-        if cleaned_text.startswith("```json"):
-            cleaned_text = generated_text[7:-3].strip()
-        elif cleaned_text.startswith("```"):
-            cleaned_text = generated_text[3:-3].strip()
-        
-        try:
-            parsed_result = json.loads(cleaned_text)
-            if not isinstance(parsed_result, dict) or "transactions" not in parsed_result or not isinstance(parsed_result["transactions"], list):
-                logger.error(f"Struktur respons JSON dari Gemini tidak valid: {parsed_result}")
-                raise Exception(f"Struktur JSON tidak valid dari Gemini API. Teks respons mentah: {generated_text}")
-                 
-            transactions_raw = parsed_result["transactions"]
-            
-            transactions_processed = []
-            for item in transactions_raw:
-                if not isinstance(item, dict):
-                    logger.warning(f"Item dalam array transactions bukan objek: {item}. Melewati.")
-                    continue
-                     
-                processed_item = {}
-                processed_item['jenis_lm'] = str(item.get('jenis_lm', 'Merk Lain'))
-                 
-                try:
-                    processed_item['berat'] = float(item.get('berat', 0.0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Gagal mengkonversi berat '{item.get('berat')}' menjadi float. Menggunakan nilai default 0.0")
-                    processed_item['berat'] = 0.0
-
-                try:
-                    processed_item['nominal'] = float(item.get('nominal', 0.0))
-                except (ValueError, TypeError):
-                    logger.warning(f"Gagal mengkonversi nominal '{item.get('nominal')}' menjadi float. Menggunakan nilai default 0.0")
-                    processed_item['nominal'] = 0.0
-
-                try:
-                    processed_item['qty'] = int(item.get('qty', 1))
-                except (ValueError, TypeError):
-                    logger.warning(f"Gagal mengkonversi qty '{item.get('qty')}' menjadi int. Menggunakan nilai default 1")
-                    processed_item['qty'] = 1
-                     
-                processed_item['tabel_savings'] = str(item.get('tabel_savings', 'Tidak Berlaku'))
-                
-                # Ambil tanggal dari respons, jika tidak ada atau tidak valid, gunakan tanggal saat ini
-                tanggal = item.get('tanggal', current_date)
-                try:
-                    # Validasi format tanggal (YYYY-MM-DD)
-                    parsed_date = datetime.strptime(tanggal, "%Y-%m-%d")
-                    current_datetime = datetime.strptime(current_date, "%Y-%m-%d")
-                    if parsed_date > current_datetime:
-                        logger.warning(f"Tanggal '{tanggal}' adalah tanggal di masa depan. Menggunakan tanggal saat ini: {current_date}")
-                        tanggal = current_date
-                except ValueError:
-                    logger.warning(f"Tanggal '{tanggal}' tidak valid. Menggunakan tanggal saat ini: {current_date}")
-                    tanggal = current_date
-                processed_item['tanggal'] = tanggal
-                 
-                transactions_processed.append(processed_item)
-
-            logger.info(f"Transaksi yang diparsing dan diproses: {transactions_processed}")
-            
-            return transactions_processed 
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Gagal mem-parse respons sebagai JSON: {cleaned_text}. Error: {e}")
-            raise Exception(f"Respons JSON tidak valid dari Gemini API: {str(e)}. Teks mentah: {generated_text}")
-        except Exception as e:
-            logger.error(f"Error saat memproses struktur JSON dari Gemini: {str(e)}. Teks mentah: {generated_text}")
-            raise Exception(f"Error memproses struktur JSON dari Gemini: {str(e)}. Teks mentah: {generated_text}")
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-        raise Exception(f"Error jaringan atau request timeout saat memanggil Gemini API: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error tak terduga saat memanggil Gemini Image API: {str(e)}")
-        raise Exception(f"Error tak terduga saat memanggil Gemini Image API: {str(e)}")
+LM_IMAGE = pipeline.Pipeline(
+    "process_image_expense_lm",
+    PROMPT_VERSION,
+    provider=pipeline.GeminiCachedImage("lm_image", LM_IMAGE_STATIC_PROMPT),
+    parse=pipeline.parse_json_strict,
+    schema=LM_IMAGE_SCHEMA,
+    record_fields=("image", "caption"),
+    respond=lambda result: {"transactions": result["transactions"]},
+    error_label="memproses gambar",
+)
 
 # Endpoint untuk memproses pengeluaran (teks) - Logam Mulia
 @app.post("/process_expense_lm")
-async def process_expense(input: ExpenseInput):
+async def process_expense(input: ExpenseInput, response: Response, idempotency_key: Optional[str] = Header(None),
+                          x_sender_id: Optional[str] = Header(None)):
     """
     Processes text input to extract LM transaction details using Gemini API.
+    The Idempotency-Key header (WhatsApp message id) deduplicates redelivered messages of
+    the same sender (X-Sender-Id); a stored result is marked with Idempotent-Replay: true.
     """
-    text = input.text.strip()
-    
-    if not text:
-        raise HTTPException(status_code=400, detail="Teks tidak boleh kosong")
-
-    try:
-        result = call_gemini_api(text)
-        if "error" in result:
-            logger.warning(f"Gemini API returned specific error for text '{text}': {result['error']}")
-            raise HTTPException(status_code=400, detail=f"Kesalahan dari Gemini: {result['error']}")
-        return result
-    except Exception as e:
-        logger.error(f"Error memproses input teks '{text}': {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat memproses teks: {str(e)}")
+    return await LM_TEXT.handle(input.dict(), idempotency_key, x_sender_id, response)
 
 # Endpoint untuk memproses pengeluaran (gambar dan caption) - Logam Mulia
 @app.post("/process_image_expense_lm")
-async def process_image_expense(input: ImageExpenseInput):
-    logger.info("Masuk ke endpoint process_image_expense_lm")
+async def process_image_expense(input: ImageExpenseInput, response: Response, idempotency_key: Optional[str] = Header(None),
+                                x_sender_id: Optional[str] = Header(None)):
     """
     Processes image and caption input to extract LM transaction details using Gemini Vision API.
     """
+    logger.info("Masuk ke endpoint process_image_expense_lm")
+    return await LM_IMAGE.handle(input.dict(), idempotency_key, x_sender_id, response)
+
+# Endpoint streaming: setiap transaksi dikirim (NDJSON) begitu selesai di-parse dari respons Gemini
+@app.post("/process_image_expense_lm_stream")
+def process_image_expense_stream(input: ImageExpenseInput):
+    """
+    Streaming variant of /process_image_expense_lm for multi-item receipts.
+    Streamed calls are not recorded and not deduplicated by Idempotency-Key.
+    """
+    logger.info("Masuk ke endpoint process_image_expense_lm_stream")
     try:
-        transactions = call_gemini_image_api(input.image, input.caption)
-        return {"transactions": transactions}
+        lines = LM_IMAGE.stream(input.dict())
     except Exception as e:
-        logger.error(f"Error memproses gambar: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat memproses gambar: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat memproses gambar: {str(e)}")
+    return StreamingResponse(lines, media_type=streaming.NDJSON_MEDIA_TYPE)
+
+# Statistik pipeline per endpoint (hit cache/fast path, panggilan provider, rata-rata waktu per tahap)
+@app.get("/stats/pipeline")
+async def pipeline_stats():
+    return pipeline.stats()
+
+# Statistik idempotency (request duplikat yang dijawab dari hasil tersimpan)
+@app.get("/stats/idempotency")
+async def idempotency_stats():
+    return idempotency.stats()
+
+# Profiling on-demand (khusus admin): sampling stack selama `seconds` detik, hasil dalam format
+# collapsed stacks untuk flame graph (flamegraph.pl, speedscope)
+@app.post("/admin/profile", response_class=PlainTextResponse)
+def admin_profile(seconds: float = 10, x_admin_token: Optional[str] = Header(None)):
+    if not profiling.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiling dinonaktifkan (ADMIN_TOKEN tidak diatur)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, profiling.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Token admin tidak valid")
+
+    profile = profiling.profile(seconds)
+    if profile is None:
+        raise HTTPException(status_code=409, detail="Profiling lain sedang berjalan")
+    return PlainTextResponse(profile)
@@ -0,0 +1,251 @@
+# merchant_memory.py
+# Memori merchant/kata kunci per pelanggan: "indomaret" -> Makanan & Minuman, "pln" -> Listrik.
+# Hanya dipelajari dari konfirmasi pengguna (/memory/confirm: worker mengirimnya untuk transaksi
+# yang tidak dibatalkan dengan "hapus terakhir"), bukan dari tebakan LLM, dan dipakai sebelum
+# memanggil LLM sehingga merchant yang berulang langsung dikategorikan tanpa round trip ke provider.
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import amounts
+import redis_client
+
+logger = logging.getLogger(__name__)
+
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() == "true"
+# Jumlah konfirmasi minimal sebelum mapping dipakai tanpa LLM
+MEMORY_MIN_HITS = int(os.getenv("MEMORY_MIN_HITS", "1"))
+MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", "200"))  # per pelanggan (LRU)
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "1000"))  # pelanggan yang disimpan di memori lokal
+MEMORY_TTL_DAYS = int(os.getenv("MEMORY_TTL_DAYS", "180"))
+
+# Kata yang tidak menentukan merchant/kategori
+STOPWORDS = {
+    "beli", "membeli", "bayar", "bayarin", "buat", "untuk", "utk", "di", "ke", "dari", "dan", "yang",
+    "harga", "total", "rp", "tadi", "hari", "ini", "pagi", "siang", "sore", "malam", "sama", "pakai",
+    "pake", "via", "lewat", "aku", "saya", "gue", "gw", "ya", "nih", "aja", "sudah", "udah",
+}
+
+# Kata yang menunjukkan tanggal selain hari ini; teks seperti ini tetap diproses LLM
+DATE_WORDS = {
+    "kemarin", "kemaren", "besok", "lusa", "tanggal", "tgl", "minggu", "bulan", "lalu",
+    "januari", "februari", "maret", "april", "mei", "juni", "juli", "agustus", "september",
+    "oktober", "november", "desember", "jan", "feb", "mar", "apr", "jun", "jul", "agu", "agt",
+    "sep", "okt", "nov", "des",
+}
+
+AMOUNT_MULTIPLIERS = {
+    "k": 1000, "rb": 1000, "ribu": 1000,
+    "jt": 1000000, "juta": 1000000,
+    "m": 1000000000, "milyar": 1000000000,
+}
+
+AMOUNT_RE = re.compile(r'(?<![\w/])(?:rp\.?\s*)?(\d+(?:[.,]\d+)*)\s*(k|rb|ribu|jt|juta|m|milyar)?(?![\w/])')
+DATE_RE = re.compile(r'\d{1,4}[/-]\d{1,2}([/-]\d{1,4})?')
+TOKEN_RE = re.compile(r'[a-z][a-z0-9]*')
+
+_users = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "confirmations": 0, "evictions": 0}
+
+
+def parse_amount(text: str):
+    """
+    Returns the single amount in the text in Rupiah, or None if there is no amount or more than one.
+    Thousands separators are resolved before the unit multiplier: "1.500rb" is 1500000.
+    """
+    matches = AMOUNT_RE.findall(text.lower())
+    if len(matches) != 1:
+        return None
+    number, unit = matches[0]
+    try:
+        value = amounts.parse_number(number)
+    except ValueError:
+        return None
+    return int(round(value * AMOUNT_MULTIPLIERS.get(unit, 1)))
+
+
+def merchant_key(text: str):
+    """
+    Normalizes a message into its merchant/keyword phrase, e.g. "bayar PLN 100rb" -> "pln".
+    Returns None when the text mentions a date other than today.
+    """
+    lowered = text.lower()
+    if DATE_RE.search(lowered):
+        return None
+    without_amounts = AMOUNT_RE.sub(" ", lowered)
+    tokens = [t for t in TOKEN_RE.findall(without_amounts) if t not in STOPWORDS]
+    if not tokens or any(t in DATE_WORDS for t in tokens):
+        return None
+    return " ".join(tokens)
+
+
+def _redis_key(user_id: str) -> str:
+    return redis_client.key("merchant_memory", user_id)
+
+
+def _fetch_user(user_id: str) -> OrderedDict:
+    entries = OrderedDict()
+    client = redis_client.get_client()
+    if client is not None:
+        try:
+            stored = client.hgetall(_redis_key(user_id))
+            loaded = [(k, json.loads(v)) for k, v in stored.items()]
+            for k, entry in sorted(loaded, key=lambda item: item[1].get("last_used", 0)):
+                entries[k] = entry
+        except Exception as e:
+            logger.warning(f"Gagal memuat memori merchant dari Redis untuk {user_id}: {str(e)}")
+            redis_client.report_failure(e)
+    return entries
+
+
+def _load_user(user_id: str) -> OrderedDict:
+    """
+    Returns the LRU mapping of a user, loading it from Redis on first access.
+    Must be called without _lock held: the Redis read runs outside the lock so a slow Redis
+    does not block other users, and the result is installed under it.
+    """
+    with _lock:
+        entries = _users.get(user_id)
+        if entries is not None:
+            _users.move_to_end(user_id)
+            return entries
+
+    loaded = _fetch_user(user_id)
+
+    with _lock:
+        # Request lain untuk pelanggan yang sama mungkin sudah memuatnya lebih dulu
+        entries = _users.get(user_id)
+        if entries is None:
+            entries = _users[user_id] = loaded
+            if len(_users) > MEMORY_MAX_USERS:
+                _users.popitem(last=False)
+        return entries
+
+
+def _persist(user_id: str, phrase: str, entry: dict, evicted: list):
+    client = redis_client.get_client()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline()
+        pipe.hset(_redis_key(user_id), phrase, json.dumps(entry, ensure_ascii=False))
+        if evicted:
+            pipe.hdel(_redis_key(user_id), *evicted)
+        pipe.expire(_redis_key(user_id), MEMORY_TTL_DAYS * 86400)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Gagal menyimpan memori merchant ke Redis untuk {user_id}: {str(e)}")
+        redis_client.report_failure(e)
+
+
+def _trusted(entry) -> bool:
+    return entry is not None and entry["hits"] >= MEMORY_MIN_HITS
+
+
+def resolve(user_id: str, text: str):
+    """
+    Categorizes a text locally from the user's memory. Returns a transaction dict in the
+    same shape as a keuangan text transaction (pipeline KEUANGAN_TEXT_SCHEMA), or None when the LLM is still needed.
+    A phrase resolves when it was confirmed as a whole, or when all its words are known
+    and agree on the same kategori/transaksi.
+    """
+    if not MEMORY_ENABLED or not user_id:
+        return None
+
+    phrase = merchant_key(text)
+    nominal = parse_amount(text)
+    if phrase is None or not nominal:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+
+    entries = _load_user(user_id)
+    with _lock:
+        entry = entries.get(phrase)
+        if not _trusted(entry):
+            words = [entries.get(word) for word in phrase.split()]
+            labels = {(w["kategori"], w["transaksi"]) for w in words if w is not None}
+            entry = words[0] if len(labels) == 1 and all(_trusted(w) for w in words) else None
+            if entry is not None and len(words) > 1:
+                entry = dict(entry, keterangan=phrase)
+
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+
+        _stats["hits"] += 1
+        stored = entries.get(phrase)
+        if stored is not None:
+            stored["last_used"] = time.time()
+            entries.move_to_end(phrase)
+
+    if stored is not None:
+        _persist(user_id, phrase, stored, [])
+
+    result = {
+        "kategori": entry["kategori"],
+        "transaksi": entry["transaksi"],
+        "nominal": nominal,
+        "tanggal": datetime.now().strftime("%Y-%m-%d"),
+        "keterangan": entry.get("keterangan") or phrase,
+    }
+    logger.info(f"Memori merchant {user_id} untuk '{phrase}': {result}")
+    return result
+
+
+def confirm(user_id: str, text: str, kategori: str, transaksi: str, keterangan: str = None):
+    """
+    Records an explicit confirmation or correction from the user. Each confirmation counts
+    as one hit; a different kategori/transaksi for a phrase replaces the old mapping.
+    """
+    if not MEMORY_ENABLED or not user_id or not kategori:
+        return
+
+    phrase = merchant_key(text)
+    if phrase is None:
+        return
+
+    transaksi = transaksi or "Pengeluaran"
+    updates = {phrase: keterangan}
+    # Kata tunggal juga dipelajari agar frasa baru dengan kata yang sama bisa dikenali
+    for word in phrase.split():
+        updates.setdefault(word, None)
+
+    persisted = []
+    evicted = []
+    entries = _load_user(user_id)
+    with _lock:
+        _stats["confirmations"] += 1
+        for key, key_keterangan in updates.items():
+            entry = entries.get(key)
+            if entry is None or entry["kategori"] != kategori or entry["transaksi"] != transaksi:
+                entry = {"kategori": kategori, "transaksi": transaksi, "keterangan": key_keterangan, "hits": 0}
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            if key_keterangan:
+                entry["keterangan"] = key_keterangan
+            entries[key] = entry
+            entries.move_to_end(key)
+            persisted.append((key, dict(entry)))
+
+        while len(entries) > MEMORY_MAX_ENTRIES:
+            evicted.append(entries.popitem(last=False)[0])
+            _stats["evictions"] += 1
+
+    for i, (key, entry) in enumerate(persisted):
+        _persist(user_id, key, entry, evicted if i == 0 else [])
+
+
+def stats() -> dict:
+    with _lock:
+        result = dict(_stats)
+        result["users_cached"] = len(_users)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else 0.0
+    return result
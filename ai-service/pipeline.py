@@ -0,0 +1,578 @@
+# pipeline.py
+# Mesin pipeline ekstraksi bersama untuk domain LM dan Keuangan. Setiap endpoint dideklarasikan
+# sebagai Pipeline (request provider, parser respons, skema field) dan melewati tahap yang sama:
+#   decode input -> cache lookup -> fast path -> panggil provider -> parse -> koersi & validasi field
+# sehingga optimasi dan metrik (timing per tahap, recorder, hedging, idempotency, statistik)
+# berlaku untuk semua endpoint sekaligus.
+import base64
+import binascii
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import requests
+from fastapi import HTTPException
+
+import amounts
+import context_cache
+import hedging
+import idempotency
+import providers
+import recorder
+import streaming
+import timing
+
+logger = logging.getLogger(__name__)
+
+# Semua pipeline yang terdaftar, per endpoint (dipakai evaluate.py dan /stats/pipeline)
+PIPELINES = {}
+
+_lock = threading.Lock()
+_stats = {}
+
+JSON_BLOCK_RE = re.compile(r'```json\n(.*?)\n```', re.DOTALL)
+
+
+class Field:
+    """
+    One output field. kind is one of "str", "float", "int", "number" (int stays int,
+    numeric strings are parsed as Rupiah amounts: "15.000" is 15000, "15,5" is 15.5),
+    "date" (YYYY-MM-DD, not in the future) or "any".
+    Missing values get the default; values that fail conversion get the default with a warning.
+    source is the key in the provider output (defaults to name).
+    """
+
+    def __init__(self, name: str, kind: str = "str", default=None, source: str = None):
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.source = source or name
+
+
+RUPIAH_PREFIX_RE = re.compile(r'^\s*rp\.?\s*', re.IGNORECASE)
+
+
+def _to_number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        number = amounts.parse_number(RUPIAH_PREFIX_RE.sub("", value))
+    else:
+        number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+CONVERTERS = {
+    "str": str,
+    "float": float,
+    "int": int,
+    "number": _to_number,
+    "any": lambda value: value,
+}
+
+
+class Schema:
+    """
+    Declarative list of fields. coerce() converts and validates a whole batch of items in
+    one pass: the reference date is parsed once per batch and each distinct tanggal once.
+    With keep_extra, keys that are not declared fields are passed through unchanged.
+    """
+
+    def __init__(self, fields: list, keep_extra: bool = False):
+        self.fields = fields
+        self.keep_extra = keep_extra
+        self._plan = [(f.name, f.source, f.kind, CONVERTERS.get(f.kind), f.default) for f in fields]
+        self._sources = {f.source for f in fields}
+
+    def coerce(self, items: list, current_date: str) -> list:
+        today = datetime.strptime(current_date, "%Y-%m-%d")
+        dates = {}
+        rows = []
+        for item in items:
+            if not isinstance(item, dict):
+                logger.warning(f"Item transaksi bukan objek: {item}. Melewati.")
+                continue
+            row = {}
+            for name, source, kind, convert, default in self._plan:
+                value = item.get(source)
+                if kind == "date":
+                    row[name] = self._coerce_date(value, current_date, today, dates)
+                elif value is None:
+                    row[name] = default
+                else:
+                    try:
+                        row[name] = convert(value)
+                    except (ValueError, TypeError):
+                        logger.warning(f"Gagal mengkonversi {name} '{value}' menjadi {kind}. Menggunakan nilai default {default}")
+                        row[name] = default
+            if self.keep_extra:
+                for key, value in item.items():
+                    if key not in self._sources and key not in row:
+                        row[key] = value
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _coerce_date(value, current_date: str, today: datetime, dates: dict) -> str:
+        if not isinstance(value, str):
+            if value is not None:
+                logger.warning(f"Tanggal '{value}' tidak valid. Menggunakan tanggal saat ini: {current_date}")
+            return current_date
+        if value in dates:
+            return dates[value]
+        try:
+            result = value
+            if datetime.strptime(value, "%Y-%m-%d") > today:
+                logger.warning(f"Tanggal '{value}' adalah tanggal di masa depan. Menggunakan tanggal saat ini: {current_date}")
+                result = current_date
+        except ValueError:
+            logger.warning(f"Tanggal '{value}' tidak valid. Menggunakan tanggal saat ini: {current_date}")
+            result = current_date
+        dates[value] = result
+        return result
+
+
+def strip_code_fence(text: str) -> str:
+    """
+    Removes a ```json ... ``` wrapper around a model response, if any.
+    """
+    text = text.strip()
+    if text.startswith("```json"):
+        return text[7:-3].strip()
+    if text.startswith("```"):
+        return text[3:-3].strip()
+    return text
+
+
+def parse_lines(text: str) -> dict:
+    """
+    Parses "Key: value" lines into one transaction. "Error: ..." becomes {"error": ...}.
+    """
+    if text.lower().startswith("error:"):
+        return {"error": text.split(":", 1)[1].strip()}
+    item = {}
+    for line in text.split("\n"):
+        if ": " in line:
+            key, value = line.split(": ", 1)
+            item[key.strip()] = value.strip()
+    return {"transactions": [item], "note": None}
+
+
+def parse_json_block(text: str) -> dict:
+    """
+    Parses the ```json block of a text answer: one transaction, or a note.
+    """
+    match = JSON_BLOCK_RE.search(text)
+    if not match:
+        raise Exception("Tidak dapat menemukan JSON dalam respons")
+    data = json.loads(match.group(1))
+    if "note" in data:
+        return {"transactions": [], "note": data["note"]}
+    return {"transactions": [data], "note": None}
+
+
+def parse_json(text: str) -> dict:
+    """
+    Parses a JSON answer that is either {"transactions": [...], "note": ...} or a bare list.
+    """
+    data = json.loads(strip_code_fence(text))
+    if isinstance(data, list):
+        logger.warning("Respons berupa list langsung, tidak dalam object dengan key 'transactions'")
+        return {"transactions": data, "note": None}
+    if isinstance(data, dict):
+        return {"transactions": data.get("transactions", []), "note": data.get("note")}
+    raise Exception("Struktur JSON tidak valid atau tidak dikenali")
+
+
+def parse_json_strict(text: str) -> dict:
+    """
+    Like parse_json, but the answer must be an object with a "transactions" list.
+    """
+    data = json.loads(strip_code_fence(text))
+    if not isinstance(data, dict) or not isinstance(data.get("transactions"), list):
+        raise Exception(f"Struktur JSON tidak valid. Teks respons mentah: {text}")
+    return {"transactions": data["transactions"], "note": data.get("note")}
+
+
+def parse_summary(text: str) -> dict:
+    return {"summary": text}
+
+
+def _api_key(env_key: str) -> str:
+    api_key = os.getenv(env_key)
+    if not api_key:
+        logger.error(f"{env_key} tidak ditemukan di environment variables")
+        raise Exception(f"{env_key} tidak ditemukan di environment variables")
+    return api_key
+
+
+def _gemini_text(result: dict) -> str:
+    return result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "").strip()
+
+
+class GeminiText:
+    """
+    Text prompt to Gemini generateContent. build_prompt(inp, current_date) -> str.
+    """
+    label = "Gemini"
+    env_key = "GEMINI_API_KEY"
+
+    def __init__(self, build_prompt, timeout: int = 30):
+        self.build_prompt = build_prompt
+        self.timeout = timeout
+
+    def prompt_text(self, inp: dict, current_date: str) -> str:
+        return self.build_prompt(inp, current_date)
+
+    def call(self, inp: dict, current_date: str) -> str:
+        api_key = _api_key(self.env_key)
+        with timing.stage("prompt"):
+            payload = {"contents": [{"parts": [{"text": self.build_prompt(inp, current_date)}]}]}
+        response = providers.post(
+            "gemini", providers.gemini_url(api_key), json=payload,
+            headers={"Content-Type": "application/json"}, timeout=self.timeout,
+        )
+        response.raise_for_status()
+        with timing.stage("parse"):
+            return _gemini_text(response.json())
+
+
+class DeepSeekChat:
+    """
+    Text prompt to DeepSeek chat completions. build_prompt(inp, current_date) -> str.
+    """
+    label = "DeepSeek"
+    env_key = "DEEPSEEK_API_KEY"
+
+    def __init__(self, build_prompt, timeout: int = 60):
+        self.build_prompt = build_prompt
+        self.timeout = timeout
+
+    def prompt_text(self, inp: dict, current_date: str) -> str:
+        return self.build_prompt(inp, current_date)
+
+    def call(self, inp: dict, current_date: str) -> str:
+        api_key = _api_key(self.env_key)
+        with timing.stage("prompt"):
+            payload = {
+                "model": "deepseek-chat",
+                "messages": [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": self.build_prompt(inp, current_date).strip()},
+                ],
+                "stream": False,
+            }
+        response = providers.post(
+            "deepseek", f"{providers.DEEPSEEK_BASE_URL}/chat/completions", json=payload,
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        with timing.stage("parse"):
+            return response.json().get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+
+
+def image_prompt_parts(image_base64: str, caption: str, current_date: str) -> list:
+    """
+    Dynamic part of the image prompts (LM and Keuangan); the static part goes through the context cache.
+    """
+    return [
+        {"text": f"""
+    Tanggal hari ini: {current_date}
+    Caption: "{caption}"
+    """},
+        {
+            "inlineData": {
+                "mimeType": "image/jpeg",
+                "data": image_base64
+            }
+        }
+    ]
+
+
+class GeminiCachedImage:
+    """
+    Image + caption to Gemini, with the static prompt served from the context cache.
+    """
+    label = "Gemini"
+    env_key = "GEMINI_API_KEY"
+
+    def __init__(self, cache_name: str, static_prompt: str, timeout: int = 60):
+        self.cache_name = cache_name
+        self.static_prompt = static_prompt
+        self.timeout = timeout
+
+    def prompt_text(self, inp: dict, current_date: str) -> str:
+        return self.static_prompt
+
+    def parts(self, inp: dict, current_date: str) -> list:
+        with timing.stage("prompt"):
+            return image_prompt_parts(inp["image"], inp["caption"], current_date)
+
+    def call(self, inp: dict, current_date: str) -> str:
+        api_key = _api_key(self.env_key)
+        response = context_cache.generate(self.cache_name, self.static_prompt, self.parts(inp, current_date), api_key, timeout=self.timeout)
+        with timing.stage("parse"):
+            return _gemini_text(response.json())
+
+
+class GeminiVoice:
+    """
+    Voice note to Gemini: the audio is uploaded to the File API, then referenced by fileUri.
+    """
+    label = "Gemini"
+    env_key = "GEMINI_API_KEY"
+
+    def __init__(self, prompt: str, mime_type: str = "audio/mp3"):
+        self.prompt = prompt
+        self.mime_type = mime_type
+
+    def prompt_text(self, inp: dict, current_date: str) -> str:
+        return self.prompt
+
+    def call(self, inp: dict, current_date: str) -> str:
+        api_key = _api_key(self.env_key)
+        headers = {"Content-Type": "application/json"}
+
+        logger.info("Mengunggah file audio ke File API Gemini")
+        upload_response = providers.post(
+            "gemini", f"{providers.GEMINI_BASE_URL}/v1beta/files?key={api_key}",
+            json={"file": {"mimeType": self.mime_type, "data": inp["file_base64"]}}, headers=headers,
+        )
+        upload_response.raise_for_status()
+        file_uri = upload_response.json().get("name")  # e.g. "files/xxxx"
+        if not file_uri:
+            raise Exception("Upload file berhasil tapi file_uri tidak ditemukan")
+
+        payload = {"contents": [{"parts": [
+            {"text": self.prompt},
+            {"fileData": {"mimeType": self.mime_type, "fileUri": file_uri}},
+        ]}]}
+        response = providers.post("gemini", providers.gemini_url(api_key), json=payload, headers=headers)
+        response.raise_for_status()
+        with timing.stage("parse"):
+            return _gemini_text(response.json())
+
+
+def decode_text(inp: dict) -> dict:
+    text = inp["text"].strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Teks tidak boleh kosong")
+    return dict(inp, text=text)
+
+
+def decode_image(inp: dict) -> dict:
+    """
+    Decodes the base64 image once for the local stages (pre-filter). Undecodable data is
+    still sent to the vision API, which decides.
+    """
+    try:
+        image_bytes = base64.b64decode(inp["image"])
+    except (binascii.Error, ValueError) as e:
+        logger.warning(f"Gambar tidak bisa di-decode dari base64: {str(e)}")
+        image_bytes = None
+    return dict(inp, image_bytes=image_bytes)
+
+
+class Pipeline:
+    """
+    One extraction endpoint. Optional stages:
+      decode(inp) -> inp                   input validation/normalization
+      lookup(inp) -> result or None        local cache (e.g. merchant memory)
+      fast_path(inp) -> result or None     cheap local answer (e.g. receipt pre-filter); bypassed
+                                           in record mode so the corpus also holds rejected inputs
+      respond(result) -> response body     endpoint-specific response shape
+    Provider call, parse and schema coercion form extract(), which is the recorded unit.
+    """
+
+    def __init__(self, endpoint: str, prompt_version: str, provider, parse, schema: Schema = None,
+                 record_fields: tuple = ("text",), decode=None, lookup=None, fast_path=None,
+                 hedge=None, respond=None, error_label: str = "memproses teks"):
+        self.endpoint = endpoint
+        self.prompt_version = prompt_version
+        self.provider = provider
+        self.parse = parse
+        self.schema = schema
+        self.record_fields = record_fields
+        self.decode = decode
+        self.lookup = lookup
+        self.fast_path = fast_path
+        self.hedge = hedge
+        self.respond = respond
+        self.error_label = error_label
+        PIPELINES[endpoint] = self
+
+    def _stage(self, name: str, fn, *args):
+        started = time.perf_counter()
+        # Tahap provider dirinci oleh timing (prompt, upstream, parse) di dalam request provider
+        request_stage = timing.stage(name) if name != "provider" else None
+        try:
+            return fn(*args)
+        finally:
+            if request_stage is not None:
+                request_stage.stop()
+            _record_stage(self.endpoint, name, (time.perf_counter() - started) * 1000)
+
+    def _call_provider(self, inp: dict, current_date: str, provider=None) -> str:
+        # Saat merekam atau memutar ulang, kedua panggilan hedging akan berbagi satu rekaman
+        # (contextvar disalin ke thread) dan respons bisa tertukar antar provider: tanpa hedging
+        if provider is not None or self.hedge is None or recorder.active():
+            provider = provider or self.provider
+            return provider.call(inp, current_date)
+        # Request cadangan ke provider hedge jika API key-nya ada, jika tidak ke provider utama lagi
+        hedge = self.hedge if os.getenv(self.hedge.env_key) else self.provider
+        text, timings = hedging.get_hedger(self.endpoint).call(
+            lambda: timing.run_isolated(lambda: self.provider.call(inp, current_date)),
+            lambda: timing.run_isolated(lambda: hedge.call(inp, current_date)),
+        )
+        # Hanya tahap dari panggilan yang menang yang dihitung untuk request ini
+        timing.merge(timings)
+        return text
+
+    def prompt_loaded(self) -> bool:
+        """
+        True when the prompts of the provider (and hedge provider) render to non-empty text
+        for a sample input. Used by the readiness check.
+        """
+        sample = {"text": "contoh 10rb", "caption": "", "image": "", "user_id": None}
+        try:
+            return all(p.prompt_text(sample, "2000-01-01").strip() for p in (self.provider, self.hedge) if p is not None)
+        except Exception as e:
+            logger.error(f"Prompt {self.endpoint} gagal disusun: {str(e)}")
+            return False
+
+    def coerce(self, transactions: list, current_date: str) -> list:
+        if self.schema is None:
+            return transactions
+        return self.schema.coerce(transactions, current_date)
+
+    def extract(self, inp: dict, provider=None) -> dict:
+        """
+        Provider call -> parse -> coerce. Returns {"transactions": [...], "note": ...},
+        {"error": ...} or {"summary": ...}. provider overrides the configured one (no hedging).
+        """
+        current_date = datetime.now().strftime("%Y-%m-%d")
+        label = (provider or self.provider).label
+        try:
+            text = self._stage("provider", self._call_provider, inp, current_date, provider)
+            logger.info(f"Respons mentah dari {label} ({self.endpoint}): {text}")
+            result = self._stage("parse", self.parse, text)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error jaringan atau request timeout saat memanggil {label} API: {str(e)}")
+            raise Exception(f"Error jaringan atau request timeout saat memanggil {label} API: {str(e)}")
+        except json.JSONDecodeError as e:
+            logger.error(f"Gagal mem-parse JSON dari respons {label}: {str(e)}")
+            raise Exception(f"Respons JSON tidak valid dari {label} API: {str(e)}")
+
+        if "transactions" in result:
+            result["transactions"] = self._stage("coerce", self.coerce, result["transactions"], current_date)
+            _record(self.endpoint, "items", len(result["transactions"]))
+        logger.info(f"Hasil {self.endpoint}: {result}")
+        return result
+
+    def process(self, inp: dict):
+        """
+        Runs every stage synchronously and returns the response body.
+        """
+        _record(self.endpoint, "requests", 1)
+        try:
+            if self.decode is not None:
+                inp = self._stage("decode", self.decode, inp)
+
+            result = self._stage("lookup", self.lookup, inp) if self.lookup is not None else None
+            if result is not None:
+                _record(self.endpoint, "lookup_hits", 1)
+            elif self.fast_path is not None:
+                result = self._stage("fast_path", self.fast_path, inp)
+                if result is not None and recorder.RECORD_MODE == "record":
+                    # Saat merekam, input yang ditolak fast path tetap dikirim ke provider agar
+                    # ikut terekam; evaluate.py mengukur false reject pre-filter dari rekaman ini
+                    _record(self.endpoint, "fast_path_bypassed", 1)
+                    result = None
+                elif result is not None:
+                    _record(self.endpoint, "fast_path_hits", 1)
+
+            if result is None:
+                recorded = {field: inp[field] for field in self.record_fields}
+                result = recorder.run(self.endpoint, recorded, self.prompt_version, lambda: self.extract(recorded))
+                _record(self.endpoint, "provider_calls", 1)
+
+            return self.respond(result) if self.respond is not None else result
+        except HTTPException:
+            _record(self.endpoint, "errors", 1)
+            raise
+        except Exception as e:
+            _record(self.endpoint, "errors", 1)
+            logger.error(f"Error {self.error_label} ({self.endpoint}): {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Terjadi kesalahan saat {self.error_label}: {str(e)}")
+
+    async def handle(self, inp: dict, idempotency_key: str = None, sender: str = None, response=None):
+        """
+        Endpoint entry point: process() in the threadpool, deduplicated by Idempotency-Key per
+        sender. A stored result is marked with the Idempotent-Replay header on response.
+        """
+        result, replayed = await idempotency.run(self.endpoint, idempotency_key, lambda: self.process(inp), sender)
+        if replayed and response is not None:
+            response.headers[idempotency.REPLAY_HEADER] = "true"
+        return result
+
+    def stream(self, inp: dict):
+        """
+        Streaming variant (image pipelines only): returns NDJSON lines, see streaming.py.
+        Streamed calls are not recorded and not deduplicated by Idempotency-Key.
+        """
+        _record(self.endpoint + "_stream", "requests", 1)
+        api_key = _api_key(self.provider.env_key)
+        if self.decode is not None:
+            inp = self._stage("decode", self.decode, inp)
+        if self.fast_path is not None:
+            result = self._stage("fast_path", self.fast_path, inp)
+            if result is not None:
+                _record(self.endpoint + "_stream", "fast_path_hits", 1)
+                return iter([streaming.done_line(0, result.get("note"))])
+
+        current_date = datetime.now().strftime("%Y-%m-%d")
+        return streaming.stream_transactions(
+            self.provider.cache_name,
+            self.provider.static_prompt,
+            self.provider.parts(inp, current_date),
+            api_key,
+            coerce=lambda items: self.coerce(items, current_date),
+            parse_final=self.parse,
+        )
+
+
+def _endpoint_stats(endpoint: str) -> dict:
+    return _stats.setdefault(endpoint, {"counters": {}, "stages": {}})
+
+
+def _record(endpoint: str, name: str, value: int):
+    with _lock:
+        counters = _endpoint_stats(endpoint)["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+
+def _record_stage(endpoint: str, name: str, elapsed_ms: float):
+    with _lock:
+        stage = _endpoint_stats(endpoint)["stages"].setdefault(name, {"runs": 0, "ms_total": 0.0})
+        stage["runs"] += 1
+        stage["ms_total"] += elapsed_ms
+
+
+def stats() -> dict:
+    """
+    Per endpoint: counters (requests, lookup/fast path hits, provider calls, errors, items)
+    and per stage the number of runs and average milliseconds.
+    """
+    with _lock:
+        return {
+            endpoint: dict(s["counters"], stages={
+                name: {"runs": stage["runs"], "ms_avg": round(stage["ms_total"] / stage["runs"], 2)}
+                for name, stage in s["stages"].items()
+            })
+            for endpoint, s in _stats.items()
+        }
@@ -0,0 +1,71 @@
+# profiling.py
+# Sampling profiler sesuai permintaan: selama jendela waktu terbatas, stack semua thread diambil
+# secara berkala dan dihitung dalam format collapsed stacks ("a;b;c 42"), yang bisa langsung
+# dibuka dengan flamegraph.pl, speedscope, atau Grafana/Pyroscope.
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Token untuk endpoint admin; jika kosong, profiling dinonaktifkan
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+_running = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def sample(seconds: float, interval_ms: float = PROFILE_INTERVAL_MS) -> Counter:
+    """
+    Samples the stacks of all other threads every interval_ms for `seconds`.
+    Returns a Counter of collapsed stack -> number of samples.
+    """
+    own_id = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    interval = interval_ms / 1000
+    while time.monotonic() < deadline:
+        for thread in threading.enumerate():
+            names.setdefault(thread.ident, thread.name)
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = _collapse(frame)
+            stacks[f"{names.get(thread_id, thread_id)};{stack}"] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def profile(seconds: float):
+    """
+    Runs one bounded profiling window and returns collapsed stacks as text, or None when
+    another profile is already running.
+    """
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    if not _running.acquire(blocking=False):
+        return None
+    try:
+        logger.info(f"Profiling dimulai selama {seconds} detik (interval {PROFILE_INTERVAL_MS} ms)")
+        stacks = sample(seconds)
+    finally:
+        _running.release()
+    logger.info(f"Profiling selesai: {sum(stacks.values())} sampel, {len(stacks)} stack unik")
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,186 @@
+# providers.py
+# Koneksi HTTP ter-pool ke provider AI (Gemini, DeepSeek) beserta prewarm dan status kesiapan.
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import recorder
+import timing
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_MODEL = "gemini-1.5-flash"
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+# Konfigurasi provider: host untuk prewarm, env API key, dan apakah wajib siap
+PROVIDERS = {
+    "gemini": {
+        "base_url": GEMINI_BASE_URL,
+        "env_key": "GEMINI_API_KEY",
+        "required": True,
+    },
+    "deepseek": {
+        "base_url": DEEPSEEK_BASE_URL,
+        "env_key": "DEEPSEEK_API_KEY",
+        "required": False,
+    },
+}
+
+POOL_MAXSIZE = int(os.getenv("PROVIDER_POOL_MAXSIZE", "10"))
+PREWARM_TIMEOUT = float(os.getenv("PROVIDER_PREWARM_TIMEOUT", "5"))
+# Interval probe ulang di background untuk semua provider yang dikonfigurasi
+PROVIDER_RECONNECT_INTERVAL = float(os.getenv("PROVIDER_RECONNECT_INTERVAL", "30"))
+
+_sessions = {}
+_status = {}
+_reconnect_thread = None
+
+
+def gemini_url(api_key: str, method: str = "generateContent", model: str = GEMINI_MODEL) -> str:
+    """
+    Builds the Gemini model URL for the given method (generateContent, streamGenerateContent, ...).
+    """
+    return f"{GEMINI_BASE_URL}/v1beta/models/{model}:{method}?key={api_key}"
+
+
+def get_session(provider: str) -> requests.Session:
+    """
+    Returns the pooled session for a provider, creating it on first use.
+    Reusing one session keeps TLS connections alive between requests.
+    """
+    session = _sessions.get(provider)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        _sessions[provider] = session
+    return session
+
+
+def post(provider: str, url: str, **kwargs):
+    """
+    POSTs to a provider through its pooled session. In replay mode the recorded
+    response is returned instead; in record mode the response is captured.
+    Streamed responses are never recorded, reading them here would consume the stream.
+    Time spent here is the "upstream" stage of the request. Connection failures and
+    successes update the readiness status.
+    """
+    with timing.stage("upstream"):
+        stream = kwargs.get("stream")
+        if not stream:
+            replayed = recorder.replay_response(provider)
+            if replayed is not None:
+                return replayed
+        try:
+            response = get_session(provider).post(url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            _record_outcome(provider, str(e))
+            raise
+        _record_outcome(provider)
+        if not stream:
+            recorder.capture_response(provider, response)
+        return response
+
+
+def _record_outcome(provider: str, error: str = None):
+    # Respons HTTP apa pun berarti provider terjangkau; read timeout tidak dihitung karena
+    # provider yang lambat tetap terkoneksi
+    status = _status.get(provider)
+    connected = error is None
+    if status is None or status["connected"] == connected:
+        return
+    if connected:
+        logger.info(f"Koneksi ke {provider} pulih")
+    else:
+        logger.warning(f"Koneksi ke {provider} terputus: {error}")
+    _status[provider] = dict(status, connected=connected, error=error)
+
+
+def use_replay_keys():
+    """
+    Sets placeholder API keys for replay mode, where providers are never called.
+    """
+    for config in PROVIDERS.values():
+        os.environ.setdefault(config["env_key"], "replay")
+
+
+def prewarm(provider: str) -> dict:
+    """
+    Opens a pooled connection to the provider so the first real request skips the TLS handshake.
+    Any HTTP response (even 404) means the connection is established.
+    """
+    config = PROVIDERS[provider]
+    status = {
+        "configured": bool(os.getenv(config["env_key"])),
+        "connected": False,
+        "required": config["required"],
+        "latency_ms": None,
+        "error": None,
+    }
+
+    if not status["configured"]:
+        status["error"] = f"{config['env_key']} tidak ditemukan di environment variables"
+        _status[provider] = status
+        return status
+
+    started = time.perf_counter()
+    try:
+        get_session(provider).head(config["base_url"], timeout=PREWARM_TIMEOUT)
+        status["connected"] = True
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Gagal prewarm koneksi ke {provider}: {str(e)}")
+        status["error"] = str(e)
+    status["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    _status[provider] = status
+    return status
+
+
+def prewarm_all() -> dict:
+    """
+    Prewarms every configured provider and returns their status.
+    """
+    return {name: prewarm(name) for name in PROVIDERS}
+
+
+def provider_status() -> dict:
+    """
+    Returns the last known readiness status per provider, without any network I/O.
+    """
+    return {name: _status.get(name) for name in PROVIDERS}
+
+
+def _reconnect_loop():
+    while True:
+        time.sleep(PROVIDER_RECONNECT_INTERVAL)
+        for name, status in provider_status().items():
+            if status is not None and status["configured"]:
+                prewarm(name)
+
+
+def start_reconnect():
+    """
+    Starts the background thread that probes every configured provider again, so
+    readiness follows outages and recoveries after startup without readiness polls
+    doing network I/O.
+    """
+    global _reconnect_thread
+    if _reconnect_thread is None:
+        _reconnect_thread = threading.Thread(target=_reconnect_loop, name="provider-reconnect", daemon=True)
+        _reconnect_thread.start()
+
+
+def providers_ready(statuses: dict) -> bool:
+    """
+    True when every required provider is configured and connected.
+    """
+    return all(
+        s is not None and s["configured"] and s["connected"]
+        for name, s in statuses.items()
+        if PROVIDERS[name]["required"]
+    )
@@ -0,0 +1,149 @@
+# receipt_filter.py
+# Pre-filter lokal (CPU saja, beberapa milidetik per gambar) yang menilai seberapa mirip gambar
+# dengan struk sebelum memanggil vision API. Gambar yang jelas bukan struk (selfie, kosong,
+# buram) langsung mendapat note tanpa memanggil provider.
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+import timing
+
+try:
+    from PIL import Image, ImageFilter, ImageStat
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+# Gambar diperkecil ke ukuran ini sebelum dianalisis
+PREFILTER_SIZE = int(os.getenv("PREFILTER_SIZE", "256"))
+# Skor minimal agar gambar dianggap mungkin struk (0..1)
+PREFILTER_MIN_SCORE = float(os.getenv("PREFILTER_MIN_SCORE", "0.3"))
+# Standar deviasi kecerahan di bawah ini dianggap gambar kosong
+PREFILTER_BLANK_STD = float(os.getenv("PREFILTER_BLANK_STD", "8"))
+# Variansi Laplacian di bawah ini dianggap buram
+PREFILTER_BLUR_VAR = float(os.getenv("PREFILTER_BLUR_VAR", "20"))
+
+# Batas normalisasi tiap fitur: nilai fitur sebesar ini dianggap skor penuh
+TEXT_DENSITY_FULL = 0.08
+BRIGHT_FRACTION_FULL = 0.5
+SATURATION_ZERO = 0.35
+# Bobot fitur pada skor akhir
+WEIGHTS = {"text_density": 0.35, "brightness": 0.25, "grayness": 0.3, "aspect": 0.1}
+
+LAPLACIAN = ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128) if Image else None
+
+_lock = threading.Lock()
+_stats = {"checked": 0, "rejected": 0, "errors": 0, "elapsed_ms_total": 0.0, "reasons": {}}
+
+
+def _clamp(value: float) -> float:
+    return max(0.0, min(1.0, value))
+
+
+def extract_features(image_bytes: bytes) -> dict:
+    """
+    Computes cheap receipt-likeness features on a downscaled copy of the image.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    # Untuk JPEG, draft() men-decode langsung pada resolusi kecil (jauh lebih cepat)
+    img.draft("RGB", (PREFILTER_SIZE, PREFILTER_SIZE))
+    img = img.convert("RGB")
+    img.thumbnail((PREFILTER_SIZE, PREFILTER_SIZE))
+    width, height = img.size
+
+    gray = img.convert("L")
+    gray_stat = ImageStat.Stat(gray)
+    histogram = gray.histogram()
+    pixels = width * height
+
+    # Filter konvolusi PIL tidak memproses piksel tepi, jadi tepi 1px dibuang
+    inner = (1, 1, width - 1, height - 1)
+    edges = gray.filter(ImageFilter.FIND_EDGES).crop(inner).point(lambda v: 255 if v > 40 else 0)
+    laplacian = gray.filter(LAPLACIAN).crop(inner)
+    saturation = img.convert("HSV").getchannel("S")
+
+    return {
+        "width": width,
+        "height": height,
+        "aspect_ratio": round(max(width, height) / max(1, min(width, height)), 3),
+        "brightness_std": round(gray_stat.stddev[0], 2),
+        "bright_fraction": round(sum(histogram[160:]) / pixels, 4),
+        "text_density": round(ImageStat.Stat(edges).mean[0] / 255, 4),
+        "laplacian_var": round(ImageStat.Stat(laplacian).var[0], 2),
+        "saturation": round(ImageStat.Stat(saturation).mean[0] / 255, 4),
+    }
+
+
+def score_features(features: dict) -> dict:
+    """
+    Turns features into a 0..1 receipt-likeness score and a decision.
+    Receipts are mostly bright, low-saturation, text-dense and elongated.
+    """
+    components = {
+        "text_density": _clamp(features["text_density"] / TEXT_DENSITY_FULL),
+        "brightness": _clamp(features["bright_fraction"] / BRIGHT_FRACTION_FULL),
+        "grayness": 1 - _clamp(features["saturation"] / SATURATION_ZERO),
+        "aspect": _clamp(features["aspect_ratio"] - 1.0),
+    }
+    score = round(sum(WEIGHTS[name] * value for name, value in components.items()), 4)
+
+    reason = None
+    if features["brightness_std"] < PREFILTER_BLANK_STD:
+        reason = "blank"
+    elif features["laplacian_var"] < PREFILTER_BLUR_VAR:
+        reason = "blur"
+    elif score < PREFILTER_MIN_SCORE:
+        reason = "low_score"
+
+    return {"is_receipt": reason is None, "score": score, "reason": reason, "components": components}
+
+
+def check_image(image_bytes) -> dict:
+    """
+    Scores a decoded image. Images that cannot be analysed (Pillow not installed,
+    undecodable data) pass through so the vision API still decides.
+    """
+    if not PREFILTER_ENABLED or Image is None:
+        return {"is_receipt": True, "score": None, "reason": None}
+
+    started = time.perf_counter()
+    try:
+        if image_bytes is None:
+            raise ValueError("gambar tidak bisa di-decode dari base64")
+        with timing.stage("prefilter"):
+            features = extract_features(image_bytes)
+            result = score_features(features)
+        result["features"] = features
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Pre-filter gagal menganalisis gambar, diteruskan ke vision API: {str(e)}")
+        with _lock:
+            _stats["errors"] += 1
+        return {"is_receipt": True, "score": None, "reason": None}
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    result["elapsed_ms"] = round(elapsed_ms, 2)
+    with _lock:
+        _stats["checked"] += 1
+        _stats["elapsed_ms_total"] += elapsed_ms
+        if not result["is_receipt"]:
+            _stats["rejected"] += 1
+            _stats["reasons"][result["reason"]] = _stats["reasons"].get(result["reason"], 0) + 1
+    return result
+
+
+def stats() -> dict:
+    with _lock:
+        checked = _stats["checked"]
+        return {
+            "enabled": PREFILTER_ENABLED and Image is not None,
+            "checked": checked,
+            "rejected": _stats["rejected"],
+            "reject_rate": round(_stats["rejected"] / checked, 4) if checked else 0.0,
+            "errors": _stats["errors"],
+            "elapsed_ms_avg": round(_stats["elapsed_ms_total"] / checked, 2) if checked else 0.0,
+            "reasons": dict(_stats["reasons"]),
+        }
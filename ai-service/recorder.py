@@ -0,0 +1,225 @@
+# recorder.py
+# Record/replay respons provider untuk korpus evaluasi offline.
+# RECORD_MODE=record menyimpan (input, versi prompt, respons mentah provider, hasil parsing, latensi)
+# ke file JSONL append-only per endpoint. RECORD_MODE=replay menyajikan rekaman tersebut sebagai provider.
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+RECORD_MODE = os.getenv("RECORD_MODE", "off").lower()  # off | record | replay
+RECORD_DIR = os.getenv("RECORD_DIR", "recordings")
+
+# Field input berukuran besar disimpan terpisah (content-addressed) agar file rekaman tetap ringkas
+BLOB_FIELDS = ("image", "file_base64")
+
+_current = contextvars.ContextVar("recording", default=None)
+_write_lock = threading.Lock()
+_replay_index = None
+
+
+class ReplayResponse:
+    """
+    Minimal stand-in for requests.Response built from a recorded provider response.
+    """
+
+    def __init__(self, status_code: int, body):
+        self.status_code = status_code
+        self._body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error (replay)")
+
+    def json(self):
+        return self._body
+
+
+def set_mode(mode: str):
+    global RECORD_MODE
+    RECORD_MODE = mode.lower()
+
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(RECORD_DIR, "blobs", f"{digest}.b64")
+
+
+def compact_input(input_data: dict) -> dict:
+    """
+    Replaces large base64 fields with a reference to a blob file, writing the blob once.
+    """
+    compacted = {}
+    for key, value in input_data.items():
+        if key in BLOB_FIELDS and isinstance(value, str) and value:
+            digest = hashlib.sha256(value.encode()).hexdigest()
+            path = _blob_path(digest)
+            if RECORD_MODE == "record" and not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    f.write(value)
+            compacted[key] = {"blob": digest}
+        else:
+            compacted[key] = value
+    return compacted
+
+
+def load_input(stored_input: dict) -> dict:
+    """
+    Inverse of compact_input: reads blob references back into base64 strings.
+    """
+    loaded = {}
+    for key, value in stored_input.items():
+        if isinstance(value, dict) and "blob" in value:
+            with open(_blob_path(value["blob"])) as f:
+                loaded[key] = f.read()
+        else:
+            loaded[key] = value
+    return loaded
+
+
+def input_key(endpoint: str, stored_input: dict) -> str:
+    canonical = json.dumps(stored_input, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(f"{endpoint}:{canonical}".encode()).hexdigest()[:16]
+
+
+def read_corpus(path: str = None):
+    """
+    Yields recordings from a JSONL file, or from every *.jsonl file in a directory.
+    """
+    path = path or RECORD_DIR
+    files = [path]
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".jsonl"))
+    for file_path in files:
+        with open(file_path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _lookup(record_id: str):
+    global _replay_index
+    if _replay_index is None:
+        # Rekaman terbaru untuk input yang sama menang
+        _replay_index = {rec["id"]: rec for rec in read_corpus()} if os.path.isdir(RECORD_DIR) else {}
+    return _replay_index.get(record_id)
+
+
+@contextmanager
+def activate(recording: dict):
+    """
+    Makes the recording current for provider calls made in this context.
+    """
+    token = _current.set(recording)
+    try:
+        yield recording
+    finally:
+        _current.reset(token)
+
+
+def active() -> bool:
+    """
+    True when provider calls in this context are being recorded or replayed.
+    """
+    return _current.get() is not None
+
+
+def replaying(responses: list) -> dict:
+    """
+    Builds a recording that serves the given provider responses in order.
+    """
+    return {"responses": [], "replay": deque(responses)}
+
+
+def capturing() -> dict:
+    """
+    Builds a recording that only collects provider responses.
+    """
+    return {"responses": [], "replay": None}
+
+
+def replay_response(provider: str):
+    """
+    Returns the next recorded response for the provider when replaying, otherwise None.
+    """
+    recording = _current.get()
+    if recording is None or recording["replay"] is None:
+        return None
+    for entry in recording["replay"]:
+        if entry["provider"] == provider:
+            recording["replay"].remove(entry)
+            return ReplayResponse(entry["status"], entry["body"])
+    raise Exception(f"Tidak ada rekaman respons {provider} untuk input ini")
+
+
+def capture_response(provider: str, response):
+    recording = _current.get()
+    if recording is None or recording["replay"] is not None:
+        return
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    recording["responses"].append({"provider": provider, "status": response.status_code, "body": body})
+
+
+def _write(record: dict):
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    with _write_lock:
+        with open(os.path.join(RECORD_DIR, f"{record['endpoint']}.jsonl"), "a") as f:
+            f.write(line + "\n")
+
+
+def run(endpoint: str, input_data: dict, prompt_version: str, fn):
+    """
+    Runs fn() for an endpoint, recording or replaying its provider responses depending on RECORD_MODE.
+    """
+    if RECORD_MODE not in ("record", "replay"):
+        return fn()
+
+    stored_input = compact_input(input_data)
+    record_id = input_key(endpoint, stored_input)
+
+    if RECORD_MODE == "replay":
+        stored = _lookup(record_id)
+        if stored is None:
+            raise Exception(f"Tidak ada rekaman untuk {endpoint} dengan id {record_id}")
+        with activate(replaying(stored["responses"])):
+            return fn()
+
+    recording = capturing()
+    started = time.perf_counter()
+    result, error = None, None
+    try:
+        with activate(recording):
+            result = fn()
+        return result
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        try:
+            _write({
+                "id": record_id,
+                "endpoint": endpoint,
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "prompt_version": prompt_version,
+                "input": stored_input,
+                "responses": recording["responses"],
+                "result": result,
+                "error": error,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+        except Exception as e:
+            logger.error(f"Gagal menyimpan rekaman {endpoint}: {str(e)}")
@@ -0,0 +1,73 @@
+# redis_client.py
+# Koneksi Redis bersama (opsional). Jika paket redis tidak terpasang atau REDIS_URL tidak diset,
+# get_client() mengembalikan None dan pemanggil memakai penyimpanan lokal.
+import logging
+import os
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+KEY_PREFIX = "ai:"
+# Setelah Redis gagal, get_client() mengembalikan None selama ini agar setiap request tidak
+# menunggu socket timeout lagi (circuit breaker)
+REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", "30"))
+
+_client = None
+_down_until = 0.0
+_last_status = None
+_last_checked = 0.0
+
+
+def get_client():
+    """
+    Returns the shared Redis client, or None when Redis is not available or failed recently.
+    """
+    global _client
+    if time.monotonic() < _down_until:
+        return None
+    if _client is None and redis is not None and REDIS_URL:
+        _client = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2, socket_connect_timeout=2)
+    return _client
+
+
+def report_failure(error: Exception):
+    """
+    Opens the circuit breaker after a failed Redis call: callers use their local fallback
+    for REDIS_RETRY_AFTER seconds.
+    """
+    global _down_until
+    if time.monotonic() >= _down_until:
+        logger.warning(f"Redis gagal, memakai penyimpanan lokal selama {REDIS_RETRY_AFTER} detik: {str(error)}")
+    _down_until = time.monotonic() + REDIS_RETRY_AFTER
+
+
+def key(*parts) -> str:
+    return KEY_PREFIX + ":".join(str(p) for p in parts)
+
+
+def status() -> dict:
+    """
+    Readiness status of Redis. Redis is optional, so "configured": False is not an error.
+    Redis is pinged at most once per REDIS_RETRY_AFTER; other calls return the last result.
+    """
+    global _last_status, _last_checked
+    if _last_status is not None and time.monotonic() - _last_checked < REDIS_RETRY_AFTER:
+        return _last_status
+
+    result = {"configured": bool(REDIS_URL and redis is not None), "connected": False, "error": None}
+    client = get_client()
+    if client is not None:
+        try:
+            client.ping()
+            result["connected"] = True
+        except Exception as e:
+            report_failure(e)
+            result["error"] = str(e)
+    _last_status, _last_checked = result, time.monotonic()
+    return result
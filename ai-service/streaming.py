@@ -0,0 +1,172 @@
+# streaming.py
+# Hasil parsial untuk struk dengan banyak item: respons Gemini dibaca sebagai stream (SSE),
+# array JSON transaksi di-parse secara bertahap, dan setiap transaksi yang sudah lengkap
+# langsung dikirim sebagai satu baris NDJSON tanpa menunggu token terakhir.
+import json
+import logging
+import time
+
+import context_cache
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class TransactionStreamParser:
+    """
+    Incremental parser for the first JSON array in a streamed response (the "transactions"
+    array, or a bare top-level array). feed() returns (index, item) for every object of that
+    array that has been closed so far, where index is the element's position in the raw
+    array (non-object elements count too), so the final parse can be reconciled by index.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_depth = None
+        self._item_start = None
+        self._index = 0
+        self._done = False
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        items = []
+        text = self.text
+        while self._pos < len(text) and not self._done:
+            char = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "," and self._array_depth is not None and self._depth == self._array_depth:
+                self._index += 1
+            elif char in "[{":
+                self._depth += 1
+                if char == "[" and self._array_depth is None:
+                    self._array_depth = self._depth
+                elif char == "{" and self._array_depth is not None and self._depth == self._array_depth + 1:
+                    self._item_start = self._pos
+            elif char in "]}":
+                if char == "}" and self._item_start is not None and self._depth == self._array_depth + 1:
+                    try:
+                        items.append((self._index, json.loads(text[self._item_start:self._pos + 1])))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Gagal mem-parse item transaksi dari stream: {str(e)}")
+                    self._item_start = None
+                elif char == "]" and self._depth == self._array_depth:
+                    self._done = True
+                self._depth -= 1
+            self._pos += 1
+        return items
+
+
+def iter_sse_text(response):
+    """
+    Yields (text_chunk, usage) for each SSE event of a streamGenerateContent response.
+    SSE responses carry no charset, so requests would fall back to ISO-8859-1; the stream is
+    always UTF-8.
+    """
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        event = json.loads(line[len("data:"):].strip())
+        parts = event.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])
+        text = "".join(part.get("text", "") for part in parts)
+        yield text, event.get("usageMetadata")
+
+
+def _line(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def done_line(count: int, note, ttft_ms: float = None, first_transaction_ms: float = None, complete: bool = True) -> str:
+    return _line({
+        "type": "done",
+        "count": count,
+        "complete": complete,
+        "note": note,
+        "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+        "first_transaction_ms": round(first_transaction_ms, 1) if first_transaction_ms is not None else None,
+    })
+
+
+def stream_transactions(name: str, static_text: str, dynamic_parts: list, api_key: str, coerce, parse_final):
+    """
+    Generator of NDJSON lines:
+      {"type": "transaction", "index": i, "transaction": {...}}  for each completed item
+      {"type": "done", "count": n, "complete": bool, "note": ..., "ttft_ms": ..., "first_transaction_ms": ...}
+      {"type": "error", "detail": "..."}  when the call fails
+    "complete" is False when the full response could not be parsed (e.g. output truncated at
+    the token limit): the items already sent are valid, but later items may be missing.
+    coerce(items) normalizes the items completed by one chunk in a single batch (invalid
+    items are dropped). parse_final(text) parses the complete response into
+    {"transactions": [...], "note": ...}; it is used for the note and for any items the
+    incremental parser missed; items are matched by their index in the raw array, so
+    nothing is sent twice.
+    """
+    started = time.perf_counter()
+    try:
+        response, path, call_started = context_cache.open_stream(name, static_text, dynamic_parts, api_key, timeout=60)
+    except Exception as e:
+        logger.error(f"Gagal membuka stream Gemini ({name}): {str(e)}")
+        yield _line({"type": "error", "detail": f"Error saat memanggil Gemini API: {str(e)}"})
+        return
+
+    parser = TransactionStreamParser()
+    usage = {}
+    ttft_ms = None
+    first_transaction_ms = None
+    count = 0
+    emitted = set()
+    try:
+        for text, chunk_usage in iter_sse_text(response):
+            if ttft_ms is None and text:
+                ttft_ms = (time.perf_counter() - call_started) * 1000
+            if chunk_usage:
+                usage = chunk_usage
+            completed = parser.feed(text)
+            emitted.update(index for index, _ in completed)
+            for transaction in coerce([item for _, item in completed]) if completed else []:
+                if first_transaction_ms is None:
+                    first_transaction_ms = (time.perf_counter() - started) * 1000
+                yield _line({"type": "transaction", "index": count, "transaction": transaction})
+                count += 1
+    except Exception as e:
+        logger.error(f"Stream Gemini ({name}) terputus: {str(e)}")
+        yield _line({"type": "error", "detail": f"Stream terputus: {str(e)}"})
+        return
+    finally:
+        response.close()
+
+    context_cache.record(name, path, (time.perf_counter() - call_started) * 1000, usage, ttft_ms)
+    logger.info(f"Respons mentah dari Gemini (stream {name}): {parser.text}")
+
+    note = None
+    complete = True
+    try:
+        final = parse_final(parser.text)
+        note = final.get("note")
+        # Item yang tidak tertangkap parser bertahap (format tak terduga) dikirim di akhir
+        missed = [item for index, item in enumerate(final["transactions"]) if index not in emitted]
+        for transaction in coerce(missed):
+            yield _line({"type": "transaction", "index": count, "transaction": transaction})
+            count += 1
+    except Exception as e:
+        logger.warning(f"Gagal mem-parse respons lengkap stream ({name}): {str(e)}")
+        if count == 0:
+            yield _line({"type": "error", "detail": f"Respons JSON tidak valid dari Gemini API: {str(e)}"})
+            return
+        # Transaksi yang sudah terkirim tetap valid, tapi respons terpotong: bisa ada yang hilang
+        complete = False
+
+    yield done_line(count, note, ttft_ms, first_transaction_ms, complete)
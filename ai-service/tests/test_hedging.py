@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+import hedging
+
+
+@pytest.fixture
+def hedger(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET", 1.0)
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY_MS", 50)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY_MS", 10)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 5)
+    return hedging.Hedger("test")
+
+
+def slow(result, seconds, finished=None):
+    def fn():
+        time.sleep(seconds)
+        if finished is not None:
+            finished.set()
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return fn
+
+
+def settle(finished):
+    # Callback statistik primary berjalan di thread pool setelah fungsinya selesai
+    assert finished.wait(2)
+    time.sleep(0.05)
+
+
+def test_delay_uses_default_until_enough_samples(hedger):
+    assert hedger.delay_ms() == 50
+    for latency in (100, 200, 300, 400, 500):
+        hedger.record_latency(latency)
+    assert hedger.delay_ms() == 500
+
+
+def test_delay_has_a_floor(hedger):
+    for _ in range(5):
+        hedger.record_latency(1)
+    assert hedger.delay_ms() == 10
+
+
+def test_fast_primary_is_not_hedged(hedger):
+    hedge = slow("hedge", 0)
+    assert hedger.call(slow("primary", 0), hedge) == "primary"
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_hedge_wins_when_primary_is_slow(hedger):
+    finished = threading.Event()
+    assert hedger.call(slow("primary", 0.3, finished), slow("hedge", 0)) == "hedge"
+    settle(finished)
+    stats = hedger.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+    assert stats["latency_saved_ms_total"] > 0
+
+
+def test_primary_wins_when_hedge_is_slower(hedger):
+    assert hedger.call(slow("primary", 0.1), slow("hedge", 0.5)) == "primary"
+    stats = hedger.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 0
+
+
+def test_no_savings_when_primary_later_fails(hedger):
+    finished = threading.Event()
+    assert hedger.call(slow(RuntimeError("primary down"), 0.3, finished), slow("hedge", 0)) == "hedge"
+    settle(finished)
+    stats = hedger.stats()
+    assert stats["hedge_wins"] == 0
+    assert stats["latency_saved_ms_total"] == 0
+
+
+def test_hedge_covers_a_failed_primary(hedger):
+    assert hedger.call(slow(RuntimeError("primary down"), 0.1), slow("hedge", 0.2)) == "hedge"
+
+
+def test_budget_exhausted_waits_for_primary(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET", 0.0)
+    hedge_calls = []
+    assert hedger.call(slow("primary", 0.1), lambda: hedge_calls.append(1)) == "primary"
+    assert hedge_calls == []
+    assert hedger.stats()["hedges"] == 0
+
+
+def test_both_fail_raises_first_error(hedger):
+    with pytest.raises(RuntimeError, match="hedge down"):
+        hedger.call(slow(RuntimeError("primary down"), 0.3), slow(RuntimeError("hedge down"), 0))
+
+
+def test_disabled_runs_primary_inline(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_ENABLED", False)
+    assert hedger.call(lambda: threading.current_thread().name, slow("hedge", 0)) == threading.current_thread().name
+    assert hedger.stats()["requests"] == 1
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import idempotency
+import redis_client
+
+
+class FailingRedis:
+    """Redis client whose every call fails, like a server that went away."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _fail(self, *args, **kwargs):
+        self.calls += 1
+        raise ConnectionError("redis down")
+
+    set = get = delete = _fail
+
+
+@pytest.fixture(autouse=True)
+def local_store(monkeypatch):
+    monkeypatch.setattr(idempotency, "_local", {})
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(redis_client, "_client", None)
+    monkeypatch.setattr(redis_client, "REDIS_URL", None)
+    monkeypatch.setattr(redis_client, "_down_until", 0.0)
+
+
+def counted(result, delay=0.0):
+    calls = []
+
+    def fn():
+        calls.append(threading.get_ident())
+        time.sleep(delay)
+        return result
+
+    return fn, calls
+
+
+def test_concurrent_duplicate_waits_for_first_result():
+    fn, calls = counted({"transactions": [1]}, delay=0.2)
+
+    async def both():
+        return await asyncio.gather(
+            idempotency.run("keuangan_text", "msg-1", fn, sender="628"),
+            idempotency.run("keuangan_text", "msg-1", fn, sender="628"),
+        )
+
+    first, second = asyncio.run(both())
+    assert len(calls) == 1
+    assert first == ({"transactions": [1]}, False)
+    assert second == ({"transactions": [1]}, True)
+
+
+def test_key_is_scoped_per_sender():
+    fn, calls = counted("ok")
+    asyncio.run(idempotency.run("keuangan_text", "msg-1", fn, sender="628"))
+    _, replayed = asyncio.run(idempotency.run("keuangan_text", "msg-1", fn, sender="629"))
+    assert not replayed
+    assert len(calls) == 2
+
+
+def test_failure_releases_key():
+    def boom():
+        raise RuntimeError("provider down")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(idempotency.run("keuangan_text", "msg-1", boom))
+
+    fn, calls = counted("ok")
+    assert asyncio.run(idempotency.run("keuangan_text", "msg-1", fn)) == ("ok", False)
+    assert len(calls) == 1
+
+
+def test_duplicate_gets_409_when_first_is_still_running(monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT", 0.0)
+    key = redis_client.key("idempotency", "keuangan_text", "-", "msg-1")
+    assert idempotency._acquire(key)
+
+    fn, calls = counted("ok")
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(idempotency.run("keuangan_text", "msg-1", fn))
+    assert excinfo.value.status_code == 409
+    assert calls == []
+
+
+def test_redis_down_falls_back_to_local_store(monkeypatch):
+    client = FailingRedis()
+    monkeypatch.setattr(redis_client, "_client", client)
+
+    fn, calls = counted("ok")
+    assert asyncio.run(idempotency.run("keuangan_text", "msg-1", fn)) == ("ok", False)
+    # The first failure opens the circuit breaker; later calls skip Redis entirely
+    assert client.calls == 1
+    assert redis_client.get_client() is None
+
+    assert asyncio.run(idempotency.run("keuangan_text", "msg-1", fn)) == ("ok", True)
+    assert len(calls) == 1
+    assert client.calls == 1
@@ -0,0 +1,103 @@
+import pytest
+
+import merchant_memory
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("makan 15000", 15000),
+    ("makan 15.000", 15000),
+    ("makan 15,000", 15000),
+    ("makan Rp 25.000", 25000),
+    ("makan rp.25.000", 25000),
+    ("bayar kos 1.250.000", 1250000),
+    ("kopi 15rb", 15000),
+    ("kopi 15 rb", 15000),
+    ("kopi 15k", 15000),
+    ("kopi 15 ribu", 15000),
+    ("kopi 12.5k", 12500),
+    ("belanja 1.500rb", 1500000),
+    ("belanja 1,500rb", 1500000),
+    ("laptop 1.5jt", 1500000),
+    ("laptop 1,5jt", 1500000),
+    ("laptop 2 juta", 2000000),
+    ("laptop 1.250jt", 1250000000),
+    ("rumah 1,2m", 1200000000),
+    ("servis 1.500,75", 1501),
+])
+def test_parse_amount(text, expected):
+    assert merchant_memory.parse_amount(text) == expected
+
+
+@pytest.mark.parametrize("text", ["makan siang", "makan 15rb minum 5rb", "tgl 12/05 makan"])
+def test_parse_amount_needs_exactly_one_amount(text):
+    assert merchant_memory.parse_amount(text) is None
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    monkeypatch.setattr(merchant_memory, "_users", merchant_memory.OrderedDict())
+    monkeypatch.setattr(merchant_memory, "_stats", dict.fromkeys(merchant_memory._stats, 0))
+    monkeypatch.setattr(merchant_memory.redis_client, "get_client", lambda: None)
+    monkeypatch.setattr(merchant_memory, "MEMORY_ENABLED", True)
+    monkeypatch.setattr(merchant_memory, "MEMORY_MIN_HITS", 1)
+    return merchant_memory
+
+
+def test_resolve_confirmed_phrase(memory):
+    memory.confirm("628", "bayar PLN 100rb", "Listrik", "Pengeluaran")
+    result = memory.resolve("628", "pln 250rb")
+    assert result["kategori"] == "Listrik"
+    assert result["transaksi"] == "Pengeluaran"
+    assert result["nominal"] == 250000
+    assert result["keterangan"] == "pln"
+    assert memory.resolve("629", "pln 250rb") is None
+
+
+def test_resolve_new_phrase_when_all_words_agree(memory):
+    memory.confirm("628", "kopi 20rb", "Makanan & Minuman", "Pengeluaran")
+    memory.confirm("628", "roti 10rb", "Makanan & Minuman", "Pengeluaran")
+    result = memory.resolve("628", "kopi roti 30rb")
+    assert result["kategori"] == "Makanan & Minuman"
+    assert result["keterangan"] == "kopi roti"
+
+
+def test_resolve_rejects_disagreeing_or_unknown_words(memory):
+    memory.confirm("628", "kopi 20rb", "Makanan & Minuman", "Pengeluaran")
+    memory.confirm("628", "bensin 50rb", "Transportasi", "Pengeluaran")
+    assert memory.resolve("628", "kopi bensin 70rb") is None
+    assert memory.resolve("628", "kopi gula 70rb") is None
+
+
+def test_later_confirmation_replaces_word_mapping(memory):
+    memory.confirm("628", "kopi 20rb", "Makanan & Minuman", "Pengeluaran")
+    memory.confirm("628", "kopi kapal api 80rb", "Belanja", "Pengeluaran")
+    assert memory.resolve("628", "kopi kapal api 80rb")["kategori"] == "Belanja"
+    assert memory.resolve("628", "kopi 20rb")["kategori"] == "Belanja"
+
+
+def test_resolve_needs_amount_and_today(memory):
+    memory.confirm("628", "pln 100rb", "Listrik", "Pengeluaran")
+    assert memory.resolve("628", "pln") is None
+    assert memory.resolve("628", "pln kemarin 100rb") is None
+
+
+def test_min_hits(memory, monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_MIN_HITS", 2)
+    memory.confirm("628", "pln 100rb", "Listrik", "Pengeluaran")
+    assert memory.resolve("628", "pln 100rb") is None
+    memory.confirm("628", "pln 100rb", "Listrik", "Pengeluaran")
+    assert memory.resolve("628", "pln 100rb")["kategori"] == "Listrik"
+    # A correction replaces the mapping and starts counting again
+    memory.confirm("628", "pln 100rb", "Tagihan", "Pengeluaran")
+    assert memory.resolve("628", "pln 100rb") is None
+
+
+def test_lru_eviction(memory, monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_MAX_ENTRIES", 2)
+    memory.confirm("628", "pln 100rb", "Listrik", "Pengeluaran")
+    memory.confirm("628", "kopi 20rb", "Makanan & Minuman", "Pengeluaran")
+    assert memory.resolve("628", "pln 100rb") is not None
+    memory.confirm("628", "bensin 50rb", "Transportasi", "Pengeluaran")
+    assert memory.resolve("628", "kopi 20rb") is None
+    assert memory.resolve("628", "pln 100rb") is not None
+    assert memory.stats()["evictions"] == 1
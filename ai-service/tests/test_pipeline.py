@@ -0,0 +1,76 @@
+import pytest
+
+import hedging
+import keuangan
+import pipeline
+import recorder
+
+
+@pytest.mark.parametrize("value, expected", [
+    (15000, 15000),
+    (15000.5, 15000.5),
+    ("15000", 15000),
+    ("15.000", 15000),
+    ("1.500.000", 1500000),
+    ("15,000", 15000),
+    ("15,5", 15.5),
+    ("12.5", 12.5),
+    ("Rp 25.000", 25000),
+    ("Rp.25.000", 25000),
+    ("-5.000", -5000),
+])
+def test_number_field_parses_rupiah_amounts(value, expected):
+    rows = keuangan.KEUANGAN_IMAGE_SCHEMA.coerce([{"nominal": value, "tanggal": "2024-01-01"}], "2024-06-01")
+    assert rows[0]["nominal"] == expected
+
+
+def test_invalid_number_gets_default():
+    rows = keuangan.KEUANGAN_TEXT_SCHEMA.coerce([{"nominal": "lima ribu"}], "2024-06-01")
+    assert rows[0]["nominal"] == 0
+
+
+def test_image_schema_keeps_unknown_keys():
+    item = {"kategori": "Makanan & Minuman", "nominal": "15.000", "tanggal": "2024-01-01", "qty": 2, "merchant": "Indomaret"}
+    row = keuangan.KEUANGAN_IMAGE_SCHEMA.coerce([item], "2024-06-01")[0]
+    assert row["qty"] == 2
+    assert row["merchant"] == "Indomaret"
+    assert row["tipe_transaksi"] == "Pengeluaran"
+
+
+def test_text_schema_drops_unknown_keys():
+    row = keuangan.KEUANGAN_TEXT_SCHEMA.coerce([{"kategori": "Listrik", "merchant": "PLN"}], "2024-06-01")[0]
+    assert "merchant" not in row
+
+
+def test_dates_are_validated():
+    rows = keuangan.KEUANGAN_TEXT_SCHEMA.coerce(
+        [{"tanggal": "2024-05-01"}, {"tanggal": "2099-01-01"}, {"tanggal": "kemarin"}, "bukan objek"],
+        "2024-06-01",
+    )
+    assert [row["tanggal"] for row in rows] == ["2024-05-01", "2024-06-01", "2024-06-01"]
+
+
+class FakeProvider:
+    label = "fake"
+    env_key = "FAKE_API_KEY"
+
+    def __init__(self, text):
+        self.text = text
+        self.calls = 0
+
+    def call(self, inp, current_date):
+        self.calls += 1
+        return self.text
+
+
+def test_recording_bypasses_hedging(monkeypatch):
+    primary, hedge = FakeProvider("primary"), FakeProvider("hedge")
+    p = pipeline.Pipeline("test", "v1", primary, parse=None, hedge=hedge)
+
+    def no_hedger(name):
+        raise AssertionError("hedging must be bypassed while recording")
+
+    monkeypatch.setattr(hedging, "get_hedger", no_hedger)
+    with recorder.activate(recorder.capturing()):
+        assert p._call_provider({}, "2000-01-01") == "primary"
+    assert (primary.calls, hedge.calls) == (1, 0)
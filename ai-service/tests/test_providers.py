@@ -0,0 +1,49 @@
+import pytest
+import requests
+
+import providers
+
+
+class FakeSession:
+    def __init__(self, error=None):
+        self.error = error
+
+    def post(self, url, **kwargs):
+        if self.error is not None:
+            raise self.error
+        response = requests.Response()
+        response.status_code = 500
+        return response
+
+
+@pytest.fixture
+def gemini_status(monkeypatch):
+    monkeypatch.setattr(providers, "_status", {
+        "gemini": {"configured": True, "connected": True, "required": True, "latency_ms": 1.0, "error": None},
+    })
+
+
+def test_connection_error_marks_provider_disconnected(gemini_status, monkeypatch):
+    monkeypatch.setattr(providers, "get_session", lambda provider: FakeSession(requests.exceptions.ConnectionError("refused")))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        providers.post("gemini", "https://example.invalid")
+    status = providers.provider_status()["gemini"]
+    assert not status["connected"]
+    assert status["error"] == "refused"
+    assert not providers.providers_ready(providers.provider_status())
+
+
+def test_read_timeout_keeps_provider_connected(gemini_status, monkeypatch):
+    monkeypatch.setattr(providers, "get_session", lambda provider: FakeSession(requests.exceptions.ReadTimeout("slow")))
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        providers.post("gemini", "https://example.invalid")
+    assert providers.provider_status()["gemini"]["connected"]
+
+
+def test_any_http_response_marks_provider_connected(gemini_status, monkeypatch):
+    providers._status["gemini"] = dict(providers._status["gemini"], connected=False, error="refused")
+    monkeypatch.setattr(providers, "get_session", lambda provider: FakeSession())
+    assert providers.post("gemini", "https://example.invalid").status_code == 500
+    status = providers.provider_status()["gemini"]
+    assert status["connected"]
+    assert status["error"] is None
@@ -0,0 +1,81 @@
+import json
+
+import context_cache
+import pipeline
+import streaming
+
+
+class FakeStreamResponse:
+    """
+    Minimal stand-in for a streamed requests.Response: SSE lines are stored as UTF-8 bytes
+    and decoded with whatever encoding the caller sets, like requests does.
+    """
+
+    def __init__(self, chunks):
+        self.encoding = "ISO-8859-1"
+        self.closed = False
+        self._lines = []
+        for chunk in chunks:
+            event = {"candidates": [{"content": {"parts": [{"text": chunk}]}}]}
+            self._lines.append(("data: " + json.dumps(event, ensure_ascii=False)).encode("utf-8"))
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self._lines:
+            yield line.decode(self.encoding) if decode_unicode else line
+
+    def close(self):
+        self.closed = True
+
+
+def run_stream(monkeypatch, chunks):
+    response = FakeStreamResponse(chunks)
+    monkeypatch.setattr(context_cache, "open_stream", lambda *args, **kwargs: (response, "full", 0.0))
+    monkeypatch.setattr(context_cache, "record", lambda *args, **kwargs: None)
+    lines = streaming.stream_transactions(
+        "keuangan_image", "static", [], "key",
+        coerce=lambda items: [item for item in items if isinstance(item, dict)],
+        parse_final=pipeline.parse_json,
+    )
+    return [json.loads(line) for line in lines], response
+
+
+def test_parser_reports_raw_array_index():
+    parser = streaming.TransactionStreamParser()
+    items = parser.feed('{"transactions": [{"a": 1}, 5, "x,y", {"b": [1, 2]}, null, {"c": "}"}]}')
+    assert items == [(0, {"a": 1}), (3, {"b": [1, 2]}), (5, {"c": "}"})]
+
+
+def test_parser_across_chunks():
+    parser = streaming.TransactionStreamParser()
+    assert parser.feed('[{"a": 1}, {"b"') == [(0, {"a": 1})]
+    assert parser.feed(': 2}]') == [(1, {"b": 2})]
+
+
+def test_mixed_array_is_not_emitted_twice(monkeypatch):
+    lines, response = run_stream(monkeypatch, ['{"transactions": [{"n": 1}, 5, ', '{"n": 2}], "note": null}'])
+    transactions = [line["transaction"] for line in lines if line["type"] == "transaction"]
+    assert transactions == [{"n": 1}, {"n": 2}]
+    assert lines[-1]["type"] == "done"
+    assert lines[-1]["count"] == 2
+    assert lines[-1]["complete"] is True
+    assert response.closed
+
+
+def test_truncated_array_keeps_completed_items(monkeypatch):
+    lines, _ = run_stream(monkeypatch, ['{"transactions": [{"n": 1}, {"n": 2}, {"n"'])
+    transactions = [line["transaction"] for line in lines if line["type"] == "transaction"]
+    assert transactions == [{"n": 1}, {"n": 2}]
+    assert lines[-1] == {
+        "type": "done", "count": 2, "complete": False, "note": None,
+        "ttft_ms": lines[-1]["ttft_ms"], "first_transaction_ms": lines[-1]["first_transaction_ms"],
+    }
+
+
+def test_truncated_before_any_item_is_an_error(monkeypatch):
+    lines, _ = run_stream(monkeypatch, ['{"transactions": [{"n"'])
+    assert [line["type"] for line in lines] == ["error"]
+
+
+def test_sse_is_decoded_as_utf8(monkeypatch):
+    lines, _ = run_stream(monkeypatch, ['[{"keterangan": "Kopi Kenangan ☕ Café"}]'])
+    assert lines[0]["transaction"] == {"keterangan": "Kopi Kenangan ☕ Café"}
@@ -0,0 +1,124 @@
+# timing.py
+# Timer per tahap (decode base64, penyusunan prompt, menunggu provider, parse JSON, logging)
+# untuk setiap request. Hasilnya dikirim di header Server-Timing dan dicatat di log request,
+# sehingga keluhan "bot lambat" dari satu pelanggan bisa dilacak ke tahap yang lambat.
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Dict tahap -> milidetik untuk request yang sedang berjalan. Objek dict yang sama dibagi ke
+# thread pool (run_in_threadpool, hedging) karena context di-copy, bukan dict-nya.
+_current = contextvars.ContextVar("timing_current", default=None)
+_lock = threading.Lock()
+# Tahap yang sedang aktif di thread ini; waktu tahap bersarang dikurangkan dari induknya
+_active = threading.local()
+
+
+def start_request() -> dict:
+    timings = {}
+    _current.set(timings)
+    return timings
+
+
+def add(name: str, elapsed_ms: float):
+    timings = _current.get()
+    if timings is None:
+        return
+    with _lock:
+        timings[name] = timings.get(name, 0.0) + elapsed_ms
+
+
+class Stage:
+    """
+    One running stage. Time spent in nested stages is attributed to them, not to this one,
+    so the stages of a request add up to at most its total time (hedged provider calls
+    contribute only the winning call's stages, see run_isolated()).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.child_ms = 0.0
+        self.started = time.perf_counter()
+        self._stack = getattr(_active, "stack", None)
+        if self._stack is None:
+            self._stack = _active.stack = []
+        self._stack.append(self)
+
+    def stop(self):
+        if self not in self._stack:
+            return
+        while self._stack[-1] is not self:
+            self._stack[-1].stop()
+        self._stack.pop()
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        add(self.name, elapsed_ms - self.child_ms)
+        if self._stack:
+            self._stack[-1].child_ms += elapsed_ms
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def stage(name: str) -> Stage:
+    """
+    Times a block: `with timing.stage("parse"): ...`, or `s = timing.stage("prompt")` ... `s.stop()`.
+    Repeated stages (several provider calls, several items) accumulate.
+    """
+    return Stage(name)
+
+
+def run_isolated(fn):
+    """
+    Runs fn() with its own timings dict and returns (result, timings). Hedged calls run this
+    way so that only the call that wins is merged into the request with merge(); the
+    abandoned call would otherwise add its upstream time on top of the winner's.
+    """
+    timings = {}
+    token = _current.set(timings)
+    try:
+        return fn(), timings
+    finally:
+        _current.reset(token)
+
+
+def merge(timings: dict):
+    for name, elapsed_ms in timings.items():
+        add(name, elapsed_ms)
+
+
+def instrument_logging():
+    """
+    Times every log emit of the root handlers as the "log" stage (formatting and writing
+    raw provider responses is not free on large receipts).
+    """
+    for handler in logging.getLogger().handlers:
+        if getattr(handler, "_timed", False):
+            continue
+        handler.emit = _timed_emit(handler.emit)
+        handler._timed = True
+
+
+def _timed_emit(emit):
+    @functools.wraps(emit)
+    def wrapper(record):
+        with stage("log"):
+            emit(record)
+    return wrapper
+
+
+def server_timing_header(timings: dict, total_ms: float) -> str:
+    """
+    Formats timings as a Server-Timing header, e.g. "upstream;dur=812.4, parse;dur=1.2, total;dur=830.0".
+    """
+    with _lock:
+        items = list(timings.items())
+    metrics = [f"{name};dur={elapsed_ms:.1f}" for name, elapsed_ms in items]
+    metrics.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(metrics)
@@ -20,14 +20,43 @@ const AI_ENDPOINT_LM = process.env.AI_ENDPOINT_LM;
 const AI_IMAGE_ENDPOINT_LM = process.env.AI_IMAGE_ENDPOINT_LM;
 const AI_ENDPOINT_KEUANGAN = process.env.AI_ENDPOINT_KEUANGAN;
 const AI_IMAGE_ENDPOINT_KEUANGAN = process.env.AI_IMAGE_ENDPOINT_KEUANGAN;
+// Konfirmasi memori merchant ada di service yang sama dengan endpoint teks keuangan
+const AI_MEMORY_CONFIRM_ENDPOINT = process.env.AI_MEMORY_CONFIRM_ENDPOINT || new URL('/memory/confirm', AI_ENDPOINT_KEUANGAN).toString();
+
+// Header Idempotency-Key (ID pesan WhatsApp) agar pesan yang dikirim ulang tidak diproses dua kali.
+// ID pesan hanya unik dalam satu chat, jadi nomor pengirim ikut dikirim sebagai X-Sender-Id.
+function idempotencyHeaders(messageId, senderId) {
+  if (!messageId) return {};
+  return senderId ? { 'Idempotency-Key': messageId, 'X-Sender-Id': senderId } : { 'Idempotency-Key': messageId };
+}
+
+// Batas waktu request ke AI service; harus lebih lama dari timeout provider di service
+// (Gemini gambar 60 detik) agar worker tidak menyerah lebih dulu
+const AI_TIMEOUT_MS = Number(process.env.AI_TIMEOUT_MS || 90000);
+const AI_BUSY_RETRIES = 3;
+const AI_BUSY_RETRY_MS = 5000;
+
+// POST ke AI service. 409 berarti pesan yang sama masih diproses oleh pengiriman lain: tunggu lalu
+// minta lagi, hasilnya dikembalikan dari penyimpanan idempotency. Baris Sheet tidak ditulis dua
+// kali karena penulisan dijaga penanda per pesan (appendOnce), bukan oleh respons ini.
+async function postToAI(url, body, messageId, senderId) {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.post(url, body, {
+        headers: { 'Content-Type': 'application/json', ...idempotencyHeaders(messageId, senderId) },
+        timeout: AI_TIMEOUT_MS
+      });
+    } catch (error) {
+      if (error.response?.status !== 409 || attempt >= AI_BUSY_RETRIES) throw error;
+      await new Promise((resolve) => setTimeout(resolve, AI_BUSY_RETRY_MS));
+    }
+  }
+}
 
 // Get category from AI untuk Logam Mulia
-async function getCategoryFromAILM(text) {
+async function getCategoryFromAILM(text, messageId, senderId) {
   try {
-    const response = await axios.post(AI_ENDPOINT_LM, { text }, {
-      headers: { 'Content-Type': 'application/json' },
-      timeout: 30000
-    });
+    const response = await postToAI(AI_ENDPOINT_LM, { text }, messageId, senderId);
     return response.data;
   } catch (error) {
     console.error('Error calling AI endpoint for Logam Mulia:', error.message);
@@ -36,12 +65,9 @@ async function getCategoryFromAILM(text) {
 }
 
 // Get category from AI untuk Keuangan
-async function getCategoryFromAIKeuangan(text) {
+async function getCategoryFromAIKeuangan(text, messageId, senderId) {
   try {
-    const response = await axios.post(AI_ENDPOINT_KEUANGAN, { text }, {
-      headers: { 'Content-Type': 'application/json' },
-      timeout: 30000
-    });
+    const response = await postToAI(AI_ENDPOINT_KEUANGAN, { text }, messageId, senderId);
     return response.data;
   } catch (error) {
     console.error('Error calling AI endpoint for Keuangan:', error.message);
@@ -50,15 +76,12 @@ async function getCategoryFromAIKeuangan(text) {
 }
 
 // Process image with AI untuk Logam Mulia
-async function processImageWithAILM(imageBuffer, caption) {
+async function processImageWithAILM(imageBuffer, caption, messageId, senderId) {
   try {
-    const response = await axios.post(AI_IMAGE_ENDPOINT_LM, { 
+    const response = await postToAI(AI_IMAGE_ENDPOINT_LM, {
       image: imageBuffer.toString('base64'),
       caption: caption
-    }, {
-      headers: { 'Content-Type': 'application/json' },
-      timeout: 30000
-    });
+    }, messageId, senderId);
     return response.data.transactions;
   } catch (error) {
     console.error('Error calling AI image endpoint for Logam Mulia:', error.message);
@@ -67,16 +90,13 @@ async function processImageWithAILM(imageBuffer, caption) {
 }
 
 // Process image with AI untuk Keuangan
-async function processImageWithAIKeuangan(imageBuffer) {
+async function processImageWithAIKeuangan(imageBuffer, messageId, senderId) {
 
   console.log('Processing image with AI for Keuangan...', AI_IMAGE_ENDPOINT_KEUANGAN);
   try {
-    const response = await axios.post(AI_IMAGE_ENDPOINT_KEUANGAN, { 
+    const response = await postToAI(AI_IMAGE_ENDPOINT_KEUANGAN, {
       image: imageBuffer.toString('base64')
-    }, {
-      headers: { 'Content-Type': 'application/json' },
-      timeout: 30000
-    });
+    }, messageId, senderId);
     return response.data.transactions;
   } catch (error) {
     console.error('Error calling AI image endpoint for Keuangan:', error.message);
@@ -84,9 +104,26 @@ async function processImageWithAIKeuangan(imageBuffer) {
   }
 }
 
+// Mengajari memori merchant bahwa kategori transaksi ini benar (tidak dibatalkan pengguna)
+async function confirmMerchantMemory(userId, { text, kategori, transaksi, keterangan }) {
+  await axios.post(AI_MEMORY_CONFIRM_ENDPOINT, {
+    user_id: userId,
+    text,
+    kategori,
+    transaksi,
+    keterangan
+  }, {
+    headers: { 'Content-Type': 'application/json' },
+    timeout: 5000
+  });
+}
+
 module.exports = {
   getCategoryFromAILM,
   getCategoryFromAIKeuangan,
   processImageWithAILM,
-  processImageWithAIKeuangan
+  processImageWithAIKeuangan,
+  idempotencyHeaders,
+  postToAI,
+  confirmMerchantMemory
 };
\ No newline at end of file
@@ -1,5 +1,15 @@
-const axios = require('axios');
-const { deleteLastTransactionsFromRedis, getLastTransactionsFromRedis, saveLastTransactionsToRedis } = require('../utils/redisHelpers');
+const {
+  deleteLastTransactionsFromRedis,
+  getLastTransactionsFromRedis,
+  saveLastTransactionsToRedis,
+  isMessageAppended,
+  appendOnce,
+  savePendingConfirmation,
+  takePendingConfirmation,
+  getPendingConfirmation,
+  deletePendingConfirmation
+} = require('../utils/redisHelpers');
+const { postToAI, confirmMerchantMemory } = require('../ai');
 
 if (!process.env.AI_ENDPOINT_KEUANGAN) {
   throw new Error("❌ Env AI_ENDPOINT_KEUANGAN belum diset");
@@ -14,9 +24,47 @@ const AI_ENDPOINT_KEUANGAN = process.env.AI_ENDPOINT_KEUANGAN;
 const AI_IMAGE_ENDPOINT_KEUANGAN = process.env.AI_IMAGE_ENDPOINT_KEUANGAN;
 const AI_VOICE_ENDPOINT_KEUANGAN = process.env.AI_VOICE_ENDPOINT_KEUANGAN;
 
-async function handleKeuanganText(sheets, customer, text) {
+// Transaksi teks yang tidak dibatalkan dengan "hapus terakhir" dalam jendela ini dianggap benar
+// dan dikonfirmasi ke memori merchant, sumber belajar satu-satunya untuk memori tersebut
+const MEMORY_CONFIRM_WINDOW_MS = Number(process.env.MEMORY_CONFIRM_WINDOW_MS || 10 * 60 * 1000);
+
+// Mengonfirmasi transaksi tertunda milik pelanggan. Dengan messageId, hanya transaksi dari pesan
+// itu yang dikonfirmasi (dipakai timer, agar tidak mengonfirmasi transaksi yang lebih baru).
+async function confirmPendingMemory(userId, messageId) {
+  try {
+    if (messageId) {
+      const pending = await getPendingConfirmation(userId);
+      if (!pending || pending.messageId !== messageId) return;
+    }
+    const pending = await takePendingConfirmation(userId);
+    if (!pending) return;
+    await confirmMerchantMemory(userId, pending);
+  } catch (error) {
+    console.error('Gagal mengonfirmasi memori merchant:', error.message);
+  }
+}
+
+// Menyimpan transaksi sebagai tertunda. Transaksi tertunda sebelumnya tidak bisa lagi dibatalkan
+// dengan "hapus terakhir", jadi dikonfirmasi sekarang.
+async function rememberForConfirmation(userId, messageId, data) {
+  await confirmPendingMemory(userId);
+  try {
+    await savePendingConfirmation(userId, { messageId, ...data });
+  } catch (error) {
+    console.error('Gagal menyimpan transaksi untuk konfirmasi memori:', error.message);
+    return;
+  }
+  setTimeout(() => confirmPendingMemory(userId, messageId), MEMORY_CONFIRM_WINDOW_MS).unref();
+}
+
+async function handleKeuanganText(sheets, customer, text, messageId) {
   try {
-    const response = await axios.post(`${AI_ENDPOINT_KEUANGAN}`, { text });
+    // Pesan yang dikirim ulang dan barisnya sudah ditulis: tidak perlu memanggil AI lagi
+    if (await isMessageAppended(customer.phoneNumber, messageId)) {
+      return { reply: null };
+    }
+
+    const response = await postToAI(`${AI_ENDPOINT_KEUANGAN}`, { text, user_id: customer.phoneNumber }, messageId, customer.phoneNumber);
 
     // Jika AI mengembalikan note tanpa transaksi
     if (response.data?.note && (!response.data.transactions || response.data.transactions.length === 0)) {
@@ -72,14 +120,18 @@ async function handleKeuanganText(sheets, customer, text) {
     const sheetName = getCurrentMonthInThreeLetters();
     const range = `${sheetName}!C:W`;
 
-    await sheets.spreadsheets.values.append({
+    const appended = await appendOnce(customer.phoneNumber, messageId, () => sheets.spreadsheets.values.append({
       spreadsheetId,
       range,
       valueInputOption: 'RAW',
       resource: { values },
-    });
+    }));
+    if (!appended) {
+      return { reply: null };
+    }
 
     // await saveLastTransactionsToRedis(`${customer.phoneNumber}`, [transaksiObj]);
+    await rememberForConfirmation(customer.phoneNumber, messageId, { text, kategori, transaksi, keterangan });
 
     return {
       reply: `✅ Transaksi dicatat!\n\n📅 Tanggal: ${formattedDate}\n📋 Kategori: ${kategori}\n💰 Nominal: ${nominalWithCurrency}\n📝 Keterangan: ${keterangan || 'Tidak ada'}`
@@ -101,7 +153,7 @@ async function handleKeuanganText(sheets, customer, text) {
 }
 
 
-async function handleKeuanganImage(sheets, customer, imageBufferBase64, caption) {
+async function handleKeuanganImage(sheets, customer, imageBufferBase64, caption, messageId) {
   try {
     if (!imageBufferBase64 || typeof imageBufferBase64 !== 'string' || imageBufferBase64.length < 1000) {
       throw new Error('Data gambar tidak valid atau terlalu kecil.');
@@ -111,11 +163,15 @@ async function handleKeuanganImage(sheets, customer, imageBufferBase64, caption)
       throw new Error('Gambar tidak terdeteksi sebagai JPEG. Harap kirim gambar dengan format yang benar.');
     }
 
+    if (await isMessageAppended(customer.phoneNumber, messageId)) {
+      return { reply: null };
+    }
+
     const image = imageBufferBase64;
-    const response = await axios.post(`${AI_IMAGE_ENDPOINT_KEUANGAN}`, {
+    const response = await postToAI(`${AI_IMAGE_ENDPOINT_KEUANGAN}`, {
       image,
       caption,
-    });
+    }, messageId, customer.phoneNumber);
 
     const transactions = response.data.transactions || [];
     const note = response.data.note;
@@ -135,28 +191,31 @@ async function handleKeuanganImage(sheets, customer, imageBufferBase64, caption)
     const sheetName = getCurrentMonthInThreeLetters();
     const range = `${sheetName}!C:W`;
 
+    // Semua baris ditulis dalam satu append agar penanda per pesan mencakup seluruh struk
+    const values = transactions.map((t) => [
+      t.tanggal,
+      t.tipe_transaksi,
+      '', '',
+      t.kategori,
+      '', '',
+      'Rp.',
+      t.nominal,
+      t.keterangan
+    ]);
+    const appended = await appendOnce(customer.phoneNumber, messageId, () => sheets.spreadsheets.values.append({
+      spreadsheetId,
+      range,
+      valueInputOption: 'RAW',
+      resource: { values },
+    }));
+    if (!appended) {
+      return { reply: null };
+    }
+
+    // await saveLastTransactionsToRedis(`${customer.phoneNumber}`, transactions);
+
     const successMessages = [];
     for (const t of transactions) {
-      const values = [[
-        t.tanggal,
-        t.tipe_transaksi,
-        '', '',
-        t.kategori,
-        '', '',
-        'Rp.',
-        t.nominal,
-        t.keterangan
-      ]];
-
-      await sheets.spreadsheets.values.append({
-        spreadsheetId,
-        range,
-        valueInputOption: 'RAW',
-        resource: { values },
-      });
-    
-      // await saveLastTransactionsToRedis(`${customer.phoneNumber}`, transactions);
-
       const dateObj = new Date(t.tanggal);
       const bulanIndo = [
         'Januari', 'Februari', 'Maret', 'April', 'Mei', 'Juni',
@@ -186,16 +245,20 @@ async function handleKeuanganImage(sheets, customer, imageBufferBase64, caption)
   }
 }
 
-async function handleKeuanganVoice(sheets, customer, audioBufferBase64, caption) {
+async function handleKeuanganVoice(sheets, customer, audioBufferBase64, caption, messageId) {
   try {
     if (!audioBufferBase64 || typeof audioBufferBase64 !== 'string' || audioBufferBase64.length < 1000) {
       throw new Error('Voice note tidak valid atau terlalu kecil.');
     }
 
-    const response = await axios.post(`${AI_VOICE_ENDPOINT_KEUANGAN}`, {
+    if (await isMessageAppended(customer.phoneNumber, messageId)) {
+      return { reply: null };
+    }
+
+    const response = await postToAI(`${AI_VOICE_ENDPOINT_KEUANGAN}`, {
       audio: audioBufferBase64,
       caption,
-    });
+    }, messageId, customer.phoneNumber);
 
     const { transactions = [], note } = response.data;
 
@@ -215,28 +278,30 @@ async function handleKeuanganVoice(sheets, customer, audioBufferBase64, caption)
     const sheetName = getCurrentMonthInThreeLetters();
     const range = `${sheetName}!C:W`;
 
+    const values = transactions.map((t) => [
+      t.tanggal,
+      t.tipe_transaksi,
+      '', '',
+      t.kategori,
+      '', '',
+      'Rp.',
+      t.nominal,
+      t.keterangan
+    ]);
+    const appended = await appendOnce(customer.phoneNumber, messageId, () => sheets.spreadsheets.values.append({
+      spreadsheetId,
+      range,
+      valueInputOption: 'RAW',
+      resource: { values },
+    }));
+    if (!appended) {
+      return { reply: null };
+    }
+
+    // await saveLastTransactionsToRedis(`${customer.phoneNumber}`, transactions);
+
     const successMessages = [];
     for (const t of transactions) {
-      const values = [[
-        t.tanggal,
-        t.tipe_transaksi,
-        '', '',
-        t.kategori,
-        '', '',
-        'Rp.',
-        t.nominal,
-        t.keterangan
-      ]];
-
-      await sheets.spreadsheets.values.append({
-        spreadsheetId,
-        range,
-        valueInputOption: 'RAW',
-        resource: { values },
-      });
-      
-      // await saveLastTransactionsToRedis(`${customer.phoneNumber}`, transactions);
-
       const dateObj = new Date(t.tanggal);
       const monthNames = ['Januari', 'Februari', 'Maret', 'April', 'Mei', 'Juni',
                           'Juli', 'Agustus', 'September', 'Oktober', 'November', 'Desember'];
@@ -266,6 +331,10 @@ async function handleHapusTerakhirKeuangan(sheets, customer) {
   }
 
   const cacheKey = `${customer.phoneNumber}`;
+  // Transaksi terakhir dibatalkan: kategorinya tidak boleh dipelajari memori merchant
+  await deletePendingConfirmation(cacheKey).catch((error) => {
+    console.error('Gagal menghapus transaksi tertunda untuk konfirmasi memori:', error.message);
+  });
   const cached = await getLastTransactionsFromRedis(cacheKey);
   
   if (!cached || cached.length === 0) {
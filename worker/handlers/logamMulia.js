@@ -1,6 +1,7 @@
 const { parseNominal, getFormattedDate } = require('../utils');
 const { getCategoryFromAILM, processImageWithAILM } = require('../ai');
 const { writeToGoogleSheetLM } = require('../sheets');
+const { isMessageAppended, appendOnce } = require('../utils/redisHelpers');
 
 // Baca config_price_gold.json
 const fs = require('fs');
@@ -36,10 +37,13 @@ function getGoldPrice(year) {
   return priceEntry.harga;
 }
 
-async function handleLogamMuliaText(sheets, customer, text) {
+async function handleLogamMuliaText(sheets, customer, text, messageId) {
+  // Pesan yang dikirim ulang dan barisnya sudah ditulis: tidak perlu memanggil AI lagi
+  if (await isMessageAppended(customer.phoneNumber, messageId)) return { reply: null };
+
   let result;
   try {
-    result = await getCategoryFromAILM(text);
+    result = await getCategoryFromAILM(text, messageId, customer.phoneNumber);
     console.log('Hasil dari AI untuk pesan teks (Logam Mulia):', result);
 
     if (result.error) {
@@ -109,7 +113,10 @@ async function handleLogamMuliaText(sheets, customer, text) {
     if (isNaN(nominal) || nominal <= 0) throw new Error('Nominal harus bernilai positif.');
     data.nominal = nominal;
 
-    await writeToGoogleSheetLM(sheets, customer.spreadsheets.logam_mulia, data); // Gunakan spreadsheets.logam_mulia
+    const appended = await appendOnce(customer.phoneNumber, messageId, () =>
+      writeToGoogleSheetLM(sheets, customer.spreadsheets.logam_mulia, data) // Gunakan spreadsheets.logam_mulia
+    );
+    if (!appended) return { reply: null };
     return {
       reply: `✅ Transaksi berhasil dicatat!\n\n📅 Tanggal: ${data.tanggal}\n🏷️ Jenis LM: ${data.jenis_lm}\n⚖️ Berat: ${data.berat}g\n💰 Nominal: Rp${nominal.toLocaleString('id-ID')}\n🔢 Qty: ${data.qty}\n📊 Tabel: ${data.tabel_savings}`
     };
@@ -121,11 +128,11 @@ async function handleLogamMuliaText(sheets, customer, text) {
   }
 }
 
-async function handleLogamMuliaImage(sheets, customer, imageBufferBase64, caption) {
+async function handleLogamMuliaImage(sheets, customer, imageBufferBase64, caption, messageId) {
   if (!caption) throw new Error('Harap sertakan tujuan savings dalam caption.');
 
   const imageBuffer = Buffer.from(imageBufferBase64, 'base64');
-  const transactions = await processImageWithAILM(imageBuffer, caption);
+  const transactions = await processImageWithAILM(imageBuffer, caption, messageId, customer.phoneNumber);
 
   if (!transactions || transactions.length === 0) {
     throw new Error('Tidak ditemukan transaksi dalam gambar.');
@@ -134,8 +141,9 @@ async function handleLogamMuliaImage(sheets, customer, imageBufferBase64, captio
   const successMessages = [];
   const tanggal = getFormattedDate();
   const seenTransactions = new Set();
+  let skipped = 0;
 
-  for (const transaction of transactions) {
+  for (const [index, transaction] of transactions.entries()) {
     const transactionKey = `${transaction.jenis_lm}|${transaction.berat}|${transaction.nominal}|${transaction.qty}`;
     if (seenTransactions.has(transactionKey)) continue;
     seenTransactions.add(transactionKey);
@@ -161,12 +169,23 @@ async function handleLogamMuliaImage(sheets, customer, imageBufferBase64, captio
     if (isNaN(nominal) || nominal <= 0) throw new Error('Nominal harus angka positif.');
     data.nominal = nominal;
 
-    await writeToGoogleSheetLM(sheets, customer.spreadsheets.logam_mulia, data);
+    // Tiap baris ditulis ke tabel savings masing-masing, jadi penandanya per baris
+    const rowId = messageId && `${messageId}:${index}`;
+    const appended = await appendOnce(customer.phoneNumber, rowId, () =>
+      writeToGoogleSheetLM(sheets, customer.spreadsheets.logam_mulia, data)
+    );
+    if (!appended) {
+      skipped++;
+      continue;
+    }
     successMessages.push(
       `✅ Transaksi berhasil dicatat!\n\n📅 Tanggal: ${data.tanggal}\n🏷️ Jenis LM: ${data.jenis_lm}\n⚖️ Berat: ${data.berat}g\n💰 Nominal: Rp${nominal.toLocaleString('id-ID')}\n🔢 Qty: ${data.qty}\n📊 Tabel: ${data.tabel_savings}`
     );
   }
 
+  // Pesan yang dikirim ulang dan semua barisnya sudah ditulis sebelumnya
+  if (successMessages.length === 0 && skipped > 0) return { reply: null };
+
   if (successMessages.length === 0) {
     throw new Error('Tidak ada transaksi valid yang ditemukan dalam gambar.');
   }
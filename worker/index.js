@@ -97,7 +97,7 @@ app.post('/process-message', async (req, res) => {
 
     if (text && !message.message?.imageMessage) {
       if (selectedFeature === 'logam_mulia') {
-        const result = await handleLogamMuliaText(sheets, customer, cleanText);
+        const result = await handleLogamMuliaText(sheets, customer, cleanText, message.key.id);
         return res.json({ reply: result.reply });
       } else if (selectedFeature === 'keuangan') {
 
@@ -107,17 +107,17 @@ app.post('/process-message', async (req, res) => {
           return res.json({ reply: result.reply });
         }
 
-        const result = await handleKeuanganText(sheets, customer, cleanText);
+        const result = await handleKeuanganText(sheets, customer, cleanText, message.key.id);
         return res.json({ reply: result.reply });
       }
     }
 
     if (imageBufferBase64) {
       if (selectedFeature === 'logam_mulia') {
-        const result = await handleLogamMuliaImage(sheets, customer, imageBufferBase64, cleanText);
+        const result = await handleLogamMuliaImage(sheets, customer, imageBufferBase64, cleanText, message.key.id);
         return res.json({ reply: result.reply });
       } else if (selectedFeature === 'keuangan') {
-        const result = await handleKeuanganImage(sheets, customer, imageBufferBase64, cleanText);
+        const result = await handleKeuanganImage(sheets, customer, imageBufferBase64, cleanText, message.key.id);
         return res.json({ reply: result.reply });
       }
     }
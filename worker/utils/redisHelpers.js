@@ -33,8 +33,111 @@ async function deleteLastTransactionsFromRedis(userId) {
     await client.del(key);
   }
 
+// Penanda "baris untuk pesan ini sudah ditulis ke Sheet". AI service boleh mengembalikan hasil
+// tersimpan untuk pesan yang dikirim ulang (Idempotency-Key); yang mencegah baris ganda adalah
+// penanda ini, yang baru diset setelah values.append berhasil.
+const APPEND_MARK_TTL = 7 * 86400;
+// Klaim sementara selama satu pengiriman sedang menulis; kedaluwarsa sendiri jika worker mati
+const APPEND_CLAIM_TTL = 120;
+const APPEND_WAIT_MS = 60000;
+const APPEND_POLL_MS = 1000;
+
+function appendKey(senderId, messageId) {
+  return `appended:${senderId}:${messageId}`;
+}
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+async function isMessageAppended(senderId, messageId) {
+  if (!messageId) return false;
+  try {
+    return (await client.get(appendKey(senderId, messageId))) === 'done';
+  } catch (err) {
+    console.error('❌ Gagal membaca penanda append dari Redis:', err.message);
+    return false;
+  }
+}
+
+// Klaim penanda untuk satu pesan: 'claimed' jika pengiriman ini yang menulis, 'done' jika baris
+// sudah ditulis, 'busy' jika pengiriman lain masih menulis sampai batas tunggu habis
+async function claimAppend(key) {
+  const deadline = Date.now() + APPEND_WAIT_MS;
+  for (;;) {
+    if ((await client.set(key, 'pending', { NX: true, EX: APPEND_CLAIM_TTL })) === 'OK') return 'claimed';
+    if ((await client.get(key)) === 'done') return 'done';
+    if (Date.now() >= deadline) return 'busy';
+    await sleep(APPEND_POLL_MS);
+  }
+}
+
+// Menjalankan append() sekali per pesan. Mengembalikan false jika baris untuk pesan ini sudah
+// ditulis oleh pengiriman sebelumnya. Jika append() gagal, klaim dilepas agar pengiriman ulang
+// menulis lagi. Tanpa Redis, append() tetap dijalankan (lebih baik dobel daripada hilang).
+async function appendOnce(senderId, messageId, append) {
+  if (!messageId) {
+    await append();
+    return true;
+  }
+
+  const key = appendKey(senderId, messageId);
+  let claim;
+  try {
+    claim = await claimAppend(key);
+  } catch (err) {
+    console.error('❌ Redis tidak tersedia untuk penanda append, menulis tanpa deduplikasi:', err.message);
+    await append();
+    return true;
+  }
+  if (claim === 'done') return false;
+  if (claim === 'busy') throw new Error('Pesan yang sama masih diproses, coba lagi nanti.');
+
+  try {
+    await append();
+  } catch (err) {
+    await client.del(key).catch(() => {});
+    throw err;
+  }
+  await client.set(key, 'done', { EX: APPEND_MARK_TTL }).catch((err) => {
+    console.error('❌ Gagal menyimpan penanda append ke Redis:', err.message);
+  });
+  return true;
+}
+
+// Transaksi teks keuangan terakhir yang belum dikonfirmasi ke memori merchant AI service.
+// Satu per pelanggan: transaksi baru menggantikannya setelah yang lama dikonfirmasi.
+const PENDING_CONFIRM_TTL = 7 * 86400;
+
+function pendingConfirmKey(userId) {
+  return `memory_pending:${userId}`;
+}
+
+async function savePendingConfirmation(userId, data) {
+  await client.set(pendingConfirmKey(userId), JSON.stringify(data), { EX: PENDING_CONFIRM_TTL });
+}
+
+// Mengambil dan menghapus sekaligus, agar timer dan pesan berikutnya tidak mengonfirmasi dua kali
+async function takePendingConfirmation(userId) {
+  const data = await client.getDel(pendingConfirmKey(userId));
+  return data ? JSON.parse(data) : null;
+}
+
+async function getPendingConfirmation(userId) {
+  const data = await client.get(pendingConfirmKey(userId));
+  return data ? JSON.parse(data) : null;
+}
+
+async function deletePendingConfirmation(userId) {
+  await client.del(pendingConfirmKey(userId));
+}
+
 module.exports = {
   saveLastTransactionsToRedis,
   getLastTransactionsFromRedis,
   deleteLastTransactionsFromRedis,
+  isMessageAppended,
+  appendOnce,
+  savePendingConfirmation,
+  takePendingConfirmation,
+  getPendingConfirmation,
+  deletePendingConfirmation,
 };